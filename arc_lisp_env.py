@@ -3,31 +3,35 @@
 Izzy Brand, 2020
 """
 import numpy as np
-import json
-import os
 import operator as op
 
+from grid_arithmetic import grid_add, grid_sub, grid_mul, grid_where, \
+    narrow, is_uint8, fits_uint8
+from task_store import get_task
+
 def array_assign(*args):
-    A = np.copy(args[0])
-    A[tuple(args[1:-1])] = args[-1]
+    A, value = args[0], args[-1]
+    # widen a uint8 grid if the new values don't fit in it
+    if is_uint8(A) and np.asarray(value).dtype.kind in 'iu' and not fits_uint8(value):
+        A = A.astype(np.int64)
+    else:
+        A = np.copy(A)
+    A[tuple(args[1:-1])] = value
     return A
 
 def make_grid(task_name, index=0, subset='train'):
     try:
-        with open(f'ARC/data/training/{task_name}.json') as f:
-            j = json.load(f)
-
-        return np.array(j[subset][index]['input'])
+        return get_task(task_name)[subset][index].input
     except:
         print("TypeError: invalid parameters for make_grid()")
 
 
 extended_env = {
-    '+':op.add, '-':op.sub, '*':op.mul, '/':op.truediv,
+    '+':grid_add, '-':grid_sub, '*':grid_mul, '/':op.truediv,
     '>':op.gt, '<':op.lt, '>=':op.ge, '<=':op.le, '==':op.eq,
     'zeros_like': np.zeros_like,
     'logical_and': np.logical_and,
-    'where': np.where,
+    'where': grid_where,
     'array': lambda *x: np.array(list(x)),
     'array_assign': array_assign,
     # 'rotate': np.rot90,
@@ -37,7 +41,7 @@ extended_env = {
     'slice': slice,
     'None': None,
     'map': map,
-    'npmap': lambda foo, iter: np.array(list(map(foo, iter))),
+    'npmap': lambda foo, iter: narrow(np.array(list(map(foo, iter)))),
     'min': min,
     'max': max,
     'set': set,
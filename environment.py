@@ -1,4 +1,5 @@
 from old_types.type_system import *
+from grid_arithmetic import grid_add, grid_sub, grid_mul
 
 def make_slice(start, end):
     if end == 0: end = None
@@ -69,9 +70,9 @@ array_assign_type = OptionType(
 # create the default environment by adding symbols using FuncCreator
 
 # arithmetic
-FuncCreator('+', binary_math_operator_type, op.add)
-FuncCreator('-', binary_math_operator_type, op.sub)
-FuncCreator('*', binary_math_operator_type, op.mul)
+FuncCreator('+', binary_math_operator_type, grid_add)
+FuncCreator('-', binary_math_operator_type, grid_sub)
+FuncCreator('*', binary_math_operator_type, grid_mul)
 FuncCreator('>', binary_math_comparator_type, op.gt)
 FuncCreator('>=', binary_math_comparator_type, op.ge)
 FuncCreator('==', binary_math_comparator_type, op.eq)
@@ -0,0 +1,133 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2020
+"""
+import numpy as np
+import operator as op
+
+
+# NOTE(izzy): numpy keeps arithmetic on a uint8 array in uint8, so with uint8
+# grids (grid - 1) wraps the black cells around to 255, (grid + 300) raises,
+# and (where mask grid -1) quietly puts 255 in the grid. The primitives in
+# arc_lisp_env, environment and language.v1 use the versions of + - * and
+# where in this module instead, which never overflow. An integer array
+# result is uint8 exactly when all of its values fit in 0-255 (whatever the
+# dtypes of the arguments, and whichever way it was computed), so grids stay
+# uint8 as long as they hold colors, and arithmetic gives the same answers
+# it did when grids were int64.
+#
+# Most of the time the result can't leave 0-255, and the op runs directly on
+# uint8. To find out, bounds turns the (lowest, highest) value of each
+# argument into the (lowest, highest) value of the result. A uint8 array is
+# first assumed to hold anything from 0 to 255, which is enough for (plus
+# grid 0) or (where mask grid 3), and otherwise its actual min or max (or
+# both, whichever the bounds need) is used instead. Only when the result
+# might not fit is the op computed in int64 (and narrowed if it fits after
+# all).
+
+def is_uint8(x):
+    return isinstance(x, (np.ndarray, np.uint8)) and x.dtype == np.uint8
+
+def fits_uint8(x):
+    """whether every value of the integer array (or scalar) x is in 0-255"""
+    x = np.asarray(x)
+    if x.size == 0:
+        return True
+    if x.dtype.kind == 'i':
+        # negative values are huge when viewed as unsigned, so a single max
+        # checks both ends of the range
+        x = x.view(np.dtype(f'u{x.dtype.itemsize}'))
+    return x.max() <= 255
+
+def widen(x):
+    """x as int64, if it's uint8"""
+    if isinstance(x, np.ndarray) and x.dtype == np.uint8:
+        return x.astype(np.int64)
+    elif isinstance(x, np.uint8):
+        return np.int64(x)
+    return x
+
+def narrow(x):
+    """x as a uint8 array, if it's an integer array whose values all fit"""
+    if isinstance(x, np.ndarray) and x.dtype.kind in 'iu' and x.dtype != np.uint8 \
+            and fits_uint8(x):
+        return x.astype(np.uint8)
+    return x
+
+def in_uint8(op, bounds, args):
+    """op(*args) computed directly on uint8, or None if the result might not
+    fit in uint8 (or the arguments aren't uint8 or bool arrays and integers
+    in 0-255)"""
+    ranges = []
+    grids = []  # the positions of the uint8 arrays in args
+    for x in args:
+        if isinstance(x, np.ndarray):
+            if x.dtype == np.uint8:
+                if x.ndim:
+                    grids.append(len(ranges))
+                ranges.append((0, 255))
+            elif x.dtype == bool:
+                ranges.append((0, 1))
+            else:
+                return None
+        elif isinstance(x, (int, np.integer)) and not isinstance(x, bool) \
+                and 0 <= x <= 255:
+            ranges.append((int(x), int(x)))
+        else:
+            return None
+
+    low, high = bounds(*ranges)
+    if low < 0 or high > 255:
+        # only find the min (max) of the grids if the lowest (highest) value
+        # is what might not fit
+        for i in grids:
+            x = args[i]
+            if x.size == 0:
+                ranges[i] = (0, 0)
+            else:
+                ranges[i] = (int(x.min()) if low < 0 else 0,
+                             int(x.max()) if high > 255 else 255)
+        low, high = bounds(*ranges)
+        if low < 0 or high > 255:
+            return None
+
+    result = op(*args)
+    # (where mask 1 2) gives int64 even though mask is uint8
+    if isinstance(result, np.ndarray) and result.dtype != np.uint8 and result.dtype.kind in 'iu':
+        result = result.astype(np.uint8)
+    return result
+
+def promoted(op, bounds=None):
+    """op, computed without overflow when any of its arguments are uint8, and
+    with an integer array result narrowed to uint8 when its values fit
+
+    bounds is an optional function from the (lowest, highest) value of each
+    argument to the (lowest, highest) value of the result. With it, op runs
+    directly on uint8 when the result can't leave 0-255.
+    """
+    def f(*args):
+        for x in args:
+            if isinstance(x, (np.ndarray, np.uint8)):
+                if bounds is not None:
+                    result = in_uint8(op, bounds, args)
+                    if result is not None:
+                        return result
+                return narrow(op(*map(widen, args)))
+        return op(*args)
+    return f
+
+def product_bounds(a, b):
+    products = [a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]]
+    return min(products), max(products)
+
+grid_add = promoted(op.add, lambda a, b: (a[0] + b[0], a[1] + b[1]))
+grid_sub = promoted(op.sub, lambda a, b: (a[0] - b[1], a[1] - b[0]))
+grid_mul = promoted(op.mul, product_bounds)
+_where = promoted(np.where, lambda c, x, y: (min(x[0], y[0]), max(x[1], y[1])))
+
+def grid_where(*args):
+    """np.where, with (where mask x y) computed like the arithmetic above.
+    (where mask) gives the indices where mask is true, and is left to numpy"""
+    if len(args) == 3:
+        return _where(*args)
+    return np.where(*args)
@@ -0,0 +1,106 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2020
+
+Checks the uint8 grid arithmetic in grid_arithmetic against the same
+arithmetic on int64, and checks that language.eval.eval_batch gives the same
+values and dtypes as evaluating each grid separately. Run from the repo root
+with
+
+    python grid_arithmetic_example.py
+"""
+import numpy as np
+
+from grid_arithmetic import grid_add, grid_sub, grid_mul, grid_where
+from language.ast import Identifier, Apply
+from language.eval import eval, eval_batch
+from language.v1 import eval_env
+
+
+def expected(op, *args):
+    """op computed on int64, and narrowed to uint8 if every value fits"""
+    args = [a.astype(np.int64) if isinstance(a, np.ndarray) and a.dtype == np.uint8
+            else int(a) if isinstance(a, np.uint8) else a for a in args]
+    result = np.asarray(op(*args))
+    if result.size == 0 or (result.min() >= 0 and result.max() <= 255):
+        return result.astype(np.uint8)
+    return result
+
+
+def same(a, b):
+    return np.array_equal(a, b) and np.asarray(a).dtype == np.asarray(b).dtype
+
+
+def random_operand(rng, shape, high):
+    kind = rng.integers(4)
+    if kind == 0:
+        return int(rng.integers(-3, 300))
+    elif kind == 1:
+        return rng.integers(0, high, size=shape).astype(np.uint8)
+    elif kind == 2:
+        return np.uint8(rng.integers(0, 256))
+    else:
+        return rng.integers(-5, 300, size=shape)
+
+
+def test_arithmetic(trials=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    ops = [(grid_add, np.add), (grid_sub, np.subtract), (grid_mul, np.multiply)]
+    failures = 0
+    for _ in range(trials):
+        high = rng.choice([10, 30, 256])
+        shape = rng.integers(0, 6, size=2)
+        x = rng.integers(0, high, size=shape).astype(np.uint8)
+        y = random_operand(rng, shape, high)
+        for f, op in ops:
+            for a, b in [(x, y), (y, x)]:
+                if not same(f(a, b), expected(op, a, b)):
+                    failures += 1
+                    print(f"{op.__name__}({a!r}, {b!r}) gave {f(a, b)!r}, "
+                          f"expected {expected(op, a, b)!r}")
+
+        mask = rng.integers(0, 2, size=shape).astype(bool)
+        for other in [int(rng.integers(-2, 12)), x]:
+            if not same(grid_where(mask, x, other), expected(np.where, mask, x, other)):
+                failures += 1
+                print(f"where({mask!r}, {x!r}, {other!r}) gave {grid_where(mask, x, other)!r}")
+
+        # the one argument form gives the indices where mask is true
+        indices = grid_where(mask)
+        if not all(np.array_equal(i, j) for i, j in zip(indices, np.where(mask))):
+            failures += 1
+            print(f"where({mask!r}) gave {indices!r}")
+
+    print(f"arithmetic:\t{failures} failures in {trials} trials")
+
+
+def test_batch(trials=50, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = Identifier("grid")
+    pred = Apply(Identifier("pred"), grid)
+    programs = [
+        pred,
+        Apply(Apply(Identifier("times"), grid), Identifier("60")),
+        Apply(Apply(Identifier("plus"), pred), Identifier("3")),
+        Apply(Identifier("pred"), pred),
+        Apply(Apply(Identifier("times"), grid), grid),
+        Apply(Apply(Identifier("plus"), Apply(Identifier("zeros_like"), grid)), grid)]
+
+    failures = 0
+    for _ in range(trials):
+        grids = [rng.integers(0, 10, size=rng.integers(1, 6, size=2)).astype(np.uint8)
+                 for _ in range(4)]
+        for program in programs:
+            separate = [eval(program, {**eval_env, "grid": g}) for g in grids]
+            batched = eval_batch(program, grids, eval_env)
+            if not all(same(a, b) for a, b in zip(separate, batched)):
+                failures += 1
+                print(f"{program} gave {[b.dtype for b in batched]} batched, "
+                      f"and {[a.dtype for a in separate]} separately")
+
+    print(f"batches:\t{failures} failures in {trials * len(programs)} programs")
+
+
+if __name__ == "__main__":
+    test_arithmetic()
+    test_batch()
@@ -5,34 +5,127 @@ Izzy Brand, 2021
 Based on an implementation by Robert Smallshire
 https://github.com/rob-smallshire/hindley-milner-python
 """
+import weakref
 
-class Identifier(object):
+# NOTE(izzy): AST nodes are immutable and hash-consed. Constructing a node
+# which is structurally equal to one that already exists returns the existing
+# node, so two subtrees are equal if and only if they are the same object.
+# That means comparing or hashing a subtree is O(1) (the hash is computed once
+# when the node is built), search can dedupe candidate programs with a set,
+# mutants can share every subtree they didn't change, and caches can be keyed
+# on subtrees. To "modify" a program, build a new one (see replace_subtree).
+
+class Node(object):
+    """Base class for AST nodes"""
+
+    __slots__ = ('_hash', 'size', '__weakref__')
+
+    # every live node, keyed by (class, fields...)
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, *args):
+        fields = cls._fields_from_args(*args)
+        key = (cls,) + fields
+        node = Node._table.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in zip(cls._field_names, fields):
+                object.__setattr__(node, name, value)
+            object.__setattr__(node, '_hash', hash((cls.__name__,) + fields))
+            object.__setattr__(node, 'size', 1 + sum(c.size for c in node.children))
+            Node._table[key] = node
+        return node
+
+    @classmethod
+    def _fields_from_args(cls, *args):
+        return args
+
+    def _args(self):
+        """the arguments which would construct this node"""
+        return tuple(getattr(self, name) for name in self._field_names)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # rebuilding the node through the constructor re-interns it
+        return (type(self), self._args())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def children(self):
+        """the child nodes, in the order with_children expects them"""
+        return ()
+
+    def with_children(self, children):
+        """a node like this one, but with the given child nodes"""
+        return self
+
+
+class Identifier(Node):
     """Identifier"""
 
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ('name',)
+    _field_names = __slots__
 
     def __str__(self):
         return self.name
 
 
-class Apply(object):
+class Apply(Node):
     """Function application"""
 
-    def __init__(self, fn, *args):
-        self.fn = fn
-        self.args = args
+    __slots__ = ('fn', 'args')
+    _field_names = __slots__
+
+    @classmethod
+    def _fields_from_args(cls, fn, *args):
+        return (fn, args)
+
+    def _args(self):
+        return (self.fn,) + self.args
+
+    @property
+    def children(self):
+        return (self.fn,) + self.args
+
+    def with_children(self, children):
+        return Apply(*children)
 
     def __str__(self):
         return f"({self.fn} {' '.join([str(a) for a in self.args])})"
 
 
-class Lambda(object):
+class Lambda(Node):
     """Lambda abstraction"""
 
-    def __init__(self, v, body):
-        self.v = v  # variable name(s) can be either str, or list of str
-        self.body = body
+    __slots__ = ('v', 'body')
+    _field_names = __slots__
+
+    @classmethod
+    def _fields_from_args(cls, v, body):
+        # variable name(s) can be either str, or a sequence of str (which we
+        # store as a tuple, so that it is hashable)
+        return (v if isinstance(v, str) else tuple(v), body)
+
+    @property
+    def children(self):
+        return (self.body,)
+
+    def with_children(self, children):
+        body, = children
+        return Lambda(self.v, body)
 
     def __str__(self):
         if isinstance(self.v, str):
@@ -41,25 +134,68 @@ class Lambda(object):
             return f"(fn {', '.join(str(i) for i in self.v)} => {self.body})"
 
 
-class Let(object):
+class Let(Node):
     """Let binding"""
 
-    def __init__(self, v, defn, body):
-        self.v = v
-        self.defn = defn
-        self.body = body
+    __slots__ = ('v', 'defn', 'body')
+    _field_names = __slots__
+
+    @property
+    def children(self):
+        return (self.defn, self.body)
+
+    def with_children(self, children):
+        defn, body = children
+        return Let(self.v, defn, body)
 
     def __str__(self):
         return f"(let {self.v} = {self.defn} in {self.body})"
 
 
-class Letrec(object):
+class Letrec(Node):
     """Letrec binding"""
 
-    def __init__(self, v, defn, body):
-        self.v = v
-        self.defn = defn
-        self.body = body
+    __slots__ = ('v', 'defn', 'body')
+    _field_names = __slots__
+
+    @property
+    def children(self):
+        return (self.defn, self.body)
+
+    def with_children(self, children):
+        defn, body = children
+        return Letrec(self.v, defn, body)
 
     def __str__(self):
         return f"(letrec {self.v} = {self.defn} in {self.body})"
+
+
+class Hole(Node):
+    """A placeholder for a subtree that hasn't been filled in yet"""
+
+    __slots__ = ()
+    _field_names = __slots__
+
+    def __str__(self):
+        return "?"
+
+
+def get_subtree(node, path):
+    """the subtree reached by following path (a sequence of child indices)"""
+    for i in path:
+        node = node.children[i]
+    return node
+
+
+def replace_subtree(node, path, new_subtree):
+    """a copy of node with the subtree at path replaced by new_subtree
+
+    Only the nodes along path are rebuilt. Every other subtree is shared
+    between node and the result.
+    """
+    if len(path) == 0:
+        return new_subtree
+    children = list(node.children)
+    i = path[0]
+    children[i] = replace_subtree(children[i], path[1:], new_subtree)
+    return node.with_children(children)
@@ -0,0 +1,137 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+import numpy as np
+
+
+# NOTE(izzy): language.eval.eval_batch runs one program on many inputs (all
+# the train and test grids of a task) at once. A value which is different for
+# each input is wrapped in a Batch. Values which are the same for every input
+# (primitives, literals, anything that doesn't depend on the grid) are left
+# unwrapped.
+#
+# If every value in a Batch is a 2D array of the same dtype, the Batch can be
+# stacked into a single 3D array, padded with zeros up to the largest height
+# and width. Primitives which have a batched implementation (see
+# language.v1.make) can then operate on all of the grids with a single numpy
+# call, instead of one call per grid.
+
+
+class Batch(object):
+    """A value which is different for each input of a batch
+
+    Args:
+        values: A list with one value per input
+    """
+
+    def __init__(self, values):
+        self._values = values
+        self._stack = None
+        self._shapes = None
+        self._stackable = None
+
+    @classmethod
+    def from_stack(cls, stack, shapes):
+        """create a Batch of 2D arrays from a padded 3D stack"""
+        batch = cls(None)
+        batch._stack = stack
+        batch._shapes = shapes
+        batch._stackable = True
+        return batch
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = [self._stack[i, :h, :w] for i, (h, w) in enumerate(self._shapes)]
+        return self._values
+
+    def __len__(self):
+        if self._shapes is not None:
+            return len(self._shapes)
+        return len(self._values)
+
+    def stacked(self):
+        """returns (stack, shapes), or None if the values can't be stacked"""
+        if self._stackable is None:
+            values = self._values
+            self._stackable = len(values) > 0 \
+                and all(isinstance(v, np.ndarray) and v.ndim == 2 for v in values) \
+                and all(v.dtype == values[0].dtype for v in values)
+        if not self._stackable:
+            return None
+
+        if self._stack is None:
+            values = self._values
+            dtype = values[0].dtype
+            shapes = [v.shape for v in values]
+            height = max(h for h, w in shapes)
+            width = max(w for h, w in shapes)
+            stack = np.zeros((len(values), height, width), dtype=dtype)
+            for i, v in enumerate(values):
+                stack[i, :v.shape[0], :v.shape[1]] = v
+            self._stack, self._shapes = stack, shapes
+        return self._stack, self._shapes
+
+
+def is_scalar(x):
+    return isinstance(x, (bool, int, np.bool_, np.integer))
+
+
+def elementwise(op, narrow=None):
+    """the batched version of an elementwise function of grids and scalars
+
+    The batched function returns NotImplemented if the arguments aren't a mix
+    of stackable Batches (with matching shapes) and scalars, in which case
+    eval_batch falls back to calling the primitive on each input separately.
+
+    If op narrows the dtype of its result depending on the values in it
+    (like grid_arithmetic.grid_add), pass the function that does that as
+    narrow. op sees the padding of the stack as well as the grids, so a
+    result that op left wide might have been narrowed for the grids alone.
+    So narrow is applied to each grid of a wide result separately.
+    """
+    def batched(*args):
+        operands = []
+        shapes = None
+        for arg in args:
+            if isinstance(arg, Batch):
+                stacked = arg.stacked()
+                if stacked is None:
+                    return NotImplemented
+                stack, arg_shapes = stacked
+                if shapes is not None and arg_shapes != shapes:
+                    return NotImplemented
+                operands.append(stack)
+                shapes = arg_shapes
+            elif is_scalar(arg):
+                operands.append(arg)
+            else:
+                return NotImplemented
+
+        if shapes is None:
+            return NotImplemented
+        result = op(*operands)
+        if narrow is not None and result.dtype.itemsize > 1:
+            values = [narrow(v) for v in Batch.from_stack(result, shapes).values]
+            if any(v.dtype != result.dtype for v in values):
+                return Batch(values)
+        return Batch.from_stack(result, shapes)
+
+    return batched
+
+
+def transpose(a):
+    """the batched version of a.T for a Batch of grids"""
+    if not isinstance(a, Batch) or a.stacked() is None:
+        return NotImplemented
+    stack, shapes = a.stacked()
+    return Batch.from_stack(stack.transpose(0, 2, 1), [(w, h) for h, w in shapes])
+
+
+def zeros_like(a, dtype):
+    """the batched version of np.zeros_like(a, dtype=dtype) for a Batch of grids"""
+    if not isinstance(a, Batch) or a.stacked() is None:
+        return NotImplemented
+    stack, shapes = a.stacked()
+    return Batch.from_stack(np.zeros(stack.shape, dtype=dtype), shapes)
@@ -0,0 +1,252 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+import numpy as np
+import time
+
+from language.ast import Identifier, Apply
+from language.compile import compile
+from language.incremental import instantiate
+from language.substitution import Substitution
+from language.type_inference import unify, lookup
+from language.types import TypeVariable, TypeOperator, Function, Integer
+from language.util import InferenceError
+from language.v1 import eval_env, type_env, Integer_array_2
+
+
+# NOTE(izzy): sampling random programs and throwing away the ones that don't
+# type check wastes most of the samples. BottomUpEnumerator builds every
+# well-typed program in order of size (the number of nodes in the AST)
+# instead. The programs of each size are grouped by their type, so a
+# function and an argument are only type checked once per pair of types
+# (rather than once per pair of programs): if a function type accepts an
+# argument type, every function of that type can be applied to every
+# argument of that type, and the results all have the same type.
+#
+# A bucket doesn't build its programs until it is iterated over: it just
+# records which buckets of functions and arguments it is the product of. So
+# counting (or skipping) millions of programs is cheap, and we only pay for
+# building the ASTs of the programs we actually try.
+#
+# The buckets are also indexed by the outermost type constructor of their
+# type, so a function which takes an array is only tried against arguments
+# whose type is an array (or a type variable).
+#
+# Programs are built from the identifiers in the type environment and
+# integer constants, applied one argument at a time (like the curried
+# primitives in language.v1). The inputs of the program (for instance grid)
+# should be in the type environment.
+
+
+def type_key(t):
+    """a hashable key for t, which is the same for types which only differ
+    in the names of their type variables"""
+    names = {}
+    def key(t):
+        if isinstance(t, TypeVariable):
+            return names.setdefault(t, len(names))
+        return (t.name,) + tuple(key(x) for x in t.types)
+    return key(t)
+
+
+def head(t):
+    """the name of the outermost type constructor of t (None for a type variable)"""
+    return t.name if isinstance(t, TypeOperator) else None
+
+
+def apply_type(fn_type, arg_type):
+    """the type of applying a function of fn_type to an arg of arg_type, or
+    None if the types don't match"""
+    if isinstance(fn_type, TypeOperator) and fn_type.name != "->":
+        return None
+    subst = Substitution()
+    result_type = TypeVariable()
+    try:
+        unify(instantiate(fn_type), Function(instantiate(arg_type), result_type), subst)
+    except InferenceError:
+        return None
+    return lookup(result_type, subst)
+
+
+class Bucket(object):
+    """The programs of one size and one type
+
+    Args:
+        t: The type of the programs
+    """
+
+    def __init__(self, t):
+        self.type = t
+        self.leaves = []
+        # pairs of (function bucket, argument bucket)
+        self.products = []
+        self.count = 0
+
+    def add_leaf(self, node):
+        self.leaves.append(node)
+        self.count += 1
+
+    def add_product(self, fns, args):
+        self.products.append((fns, args))
+        self.count += fns.count * args.count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        yield from self.leaves
+        for fns, args in self.products:
+            args = list(args)
+            for fn in fns:
+                for arg in args:
+                    yield Apply(fn, arg)
+
+
+class BottomUpEnumerator(object):
+    """Enumerates well-typed programs, smallest first
+
+    Args:
+        type_env: The type environment. Every name in it is used as a leaf
+        constants: The integer literals to use as leaves
+    """
+
+    def __init__(self, type_env, constants=range(10)):
+        self.type_env = type_env
+        # bank[size] maps a type_key to the Bucket of programs of that type
+        self.bank = [{}, {}]
+        # heads[size] maps a type constructor name (or None for a type
+        # variable) to the type_keys in bank[size] with that outermost type
+        self.heads = [{}, {}]
+        # the result of apply_type for each pair of type keys we've tried
+        self.applications = {}
+        for name, t in type_env.items():
+            self.add(1, Identifier(name), t)
+        for c in constants:
+            self.add(1, Identifier(str(c)), Integer)
+
+    def add(self, size, node, t):
+        self.bucket(size, type_key(t), t).add_leaf(node)
+
+    def bucket(self, size, key, t):
+        """the Bucket of programs of size with type t, which has type_key key"""
+        bucket = self.bank[size].get(key)
+        if bucket is None:
+            bucket = Bucket(t)
+            self.bank[size][key] = bucket
+            self.heads[size].setdefault(head(t), []).append(key)
+        return bucket
+
+    def programs_of_size(self, size):
+        """every well-typed program of size, as {type_key: Bucket}"""
+        while len(self.bank) <= size:
+            self.grow()
+        return self.bank[size]
+
+    def grow(self):
+        """enumerate the programs of the next size"""
+        size = len(self.bank)
+        self.bank.append({})
+        self.heads.append({})
+        # an Apply node of size n has a function of size a and an argument of
+        # size n - 1 - a
+        for fn_size in range(1, size - 1):
+            arg_size = size - 1 - fn_size
+            for fn_key, fns in self.bank[fn_size].items():
+                for arg_key in self.arg_keys(fns.type, arg_size):
+                    args = self.bank[arg_size][arg_key]
+                    if (fn_key, arg_key) not in self.applications:
+                        result_type = apply_type(fns.type, args.type)
+                        self.applications[fn_key, arg_key] = (
+                            None if result_type is None else (type_key(result_type), result_type))
+                    application = self.applications[fn_key, arg_key]
+                    if application is None:
+                        continue
+                    key, result_type = application
+                    self.bucket(size, key, result_type).add_product(fns, args)
+
+    def arg_keys(self, fn_type, arg_size):
+        """the type_keys of the arguments of arg_size that fn_type might accept"""
+        heads = self.heads[arg_size]
+        if not isinstance(fn_type, TypeOperator):
+            # a type variable could be any function
+            return [key for keys in heads.values() for key in keys]
+        elif fn_type.name != "->" or len(fn_type.types) != 2:
+            return []
+        arg_head = head(fn_type.types[0])
+        if arg_head is None:
+            return [key for keys in heads.values() for key in keys]
+        return heads.get(arg_head, []) + heads.get(None, [])
+
+    def enumerate(self, max_size, target_type=None):
+        """yields (program, type) for every well-typed program up to max_size,
+        smallest first. If target_type is given, only programs whose type
+        unifies with it are yielded"""
+        for size in range(1, max_size + 1):
+            for bucket in self.programs_of_size(size).values():
+                if target_type is not None and not types_match(bucket.type, target_type):
+                    continue
+                for program in bucket:
+                    yield program, bucket.type
+
+    def count(self, size, target_type=None):
+        """the number of programs of size (with a type that unifies with target_type)"""
+        return sum(len(bucket) for bucket in self.programs_of_size(size).values()
+                   if target_type is None or types_match(bucket.type, target_type))
+
+
+def types_match(t1, t2):
+    try:
+        unify(instantiate(t1), instantiate(t2), Substitution())
+        return True
+    except InferenceError:
+        return False
+
+
+def search(examples, max_size=8, env=eval_env, types=type_env, var="grid"):
+    """find the smallest program which maps each input grid to its output
+
+    Args:
+        examples: A list of (input, output) pairs of grids
+        max_size: The largest program to try
+        env: The evaluation environment
+        types: The type environment (var is added to it)
+        var: The name of the input
+
+    Returns:
+        The program, and the number of programs that were tried. The program
+        is None if no program of at most max_size works
+    """
+    enumerator = BottomUpEnumerator({**types, var: Integer_array_2})
+    tried = 0
+    for program, _ in enumerator.enumerate(max_size, Integer_array_2):
+        tried += 1
+        try:
+            f = compile(program, [var], env)
+            if all(np.array_equal(f(i), o) for i, o in examples):
+                return program, tried
+        except Exception:
+            continue
+    return None, tried
+
+
+if __name__ == '__main__':
+    enumerator = BottomUpEnumerator({**type_env, "grid": Integer_array_2})
+    for size in range(1, 16, 2):
+        start = time.time()
+        n = enumerator.count(size)
+        elapsed = time.time() - start
+        print(f"size {size}:\t{n} programs\t{len(enumerator.bank[size])} types"
+              f"\t{elapsed:.2f}s")
+
+    # building the ASTs is the slow part, so time that separately
+    start = time.time()
+    n = sum(1 for _ in enumerator.enumerate(11))
+    elapsed = time.time() - start
+    print(f"built {n} programs up to size 11 in {elapsed:.2f}s "
+          f"({n / elapsed:.0f} programs/s)")
+
+    grids = [np.random.randint(10, size=np.random.randint(1, 10, size=2)) for _ in range(3)]
+    examples = [(g, g.T) for g in grids]
+    program, tried = search(examples)
+    print(f"Found {program} after {tried} programs")
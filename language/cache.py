@@ -0,0 +1,132 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+from collections import OrderedDict
+from collections.abc import Iterator
+import numpy as np
+import sys
+
+
+# NOTE(izzy): during search, most candidate programs are small mutations of
+# programs we have already run, so they share almost all of their subtrees
+# (like (eq grid 1) or (zeros_like grid)) with something we have already
+# evaluated on the same input. An ExprCache remembers the value of a subtree
+# on an example, keyed by (subtree, example_id), so that evaluating a mutated
+# program only pays for the subtrees that changed.
+#
+# The subtree part of the key has to be hashable and compare structurally.
+# language.ast nodes are hash-consed, so they can be used directly. (lis
+# programs are nested lists, so lis.eval_cached freezes them into tuples.)
+#
+# The evaluators only put a subtree in the cache if its value is determined by
+# the example alone: it doesn't refer to any variable bound by an enclosing
+# lambda, let or define. It's up to the caller to make sure example_id
+# identifies everything else the program can see (the input grid, and the
+# global environment, which is assumed not to change).
+
+
+def value_nbytes(value):
+    """an estimate of the memory used by a cached value"""
+    # (getsizeof already includes the data of an array which owns it)
+    if isinstance(value, np.ndarray) and value.base is not None:
+        return sys.getsizeof(value) + value.nbytes
+    return sys.getsizeof(value)
+
+
+def is_shareable(value):
+    """whether value can be handed out to more than one program"""
+    # mutable containers could be modified by whoever gets them, an iterator
+    # (like the result of map) can only be consumed once, and a function
+    # (like the partial application (plus 0)) is compared by identity, so
+    # sharing one makes ((eq (plus 0)) (plus 0)) true
+    return not (isinstance(value, (list, dict, set, bytearray, Iterator))
+                or callable(value))
+
+
+class ExprCache(object):
+    """A least-recently-used cache of subexpression values
+
+    Args:
+        max_entries: The maximum number of values to keep
+        max_bytes: The maximum total size of the values to keep (see
+            value_nbytes). A single value larger than this is never cached
+    """
+
+    def __init__(self, max_entries=100000, max_bytes=256 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """the value cached for key (and count a hit), or default (and count a miss)"""
+        return self.get_with_cost(key, default)[0]
+
+    def get_with_cost(self, key, default=None):
+        """(value, cost) for key, where cost is whatever was passed to put
+        (and count a hit), or (default, None) (and count a miss)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[2]
+
+    def put(self, key, value, cost=None):
+        """cache value for key, evicting the least recently used values to make room
+
+        cost is kept with the value, for an evaluator that needs to know how
+        much work it would have taken to compute it (see lis.eval_cached)
+        """
+        if not is_shareable(value):
+            return
+        nbytes = value_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        # NOTE(izzy): the same array is going to be handed to every program
+        # that contains this subtree, so make sure none of them can modify it
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+
+        self.discard(key)
+        self.entries[key] = (value, nbytes, cost)
+        self.nbytes += nbytes
+
+        while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes, _) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+            self.evictions += 1
+
+    def discard(self, key):
+        """remove the value cached for key, if there is one"""
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()}
+
+    def __str__(self):
+        return (f'ExprCache({len(self.entries)} entries, {self.nbytes} bytes, '
+                f'{self.hits} hits, {self.misses} misses, {self.evictions} evictions)')
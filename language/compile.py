@@ -0,0 +1,153 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+
+from language.resolve import resolve, Local, Global, Constant, Call, Cond, Closure, Bind
+
+
+# NOTE(izzy): language.eval.eval walks the AST every time a program is run,
+# which means every run pays for the isinstance checks on every node. When we
+# are searching, we run the same program on every train pair, so it's worth
+# doing all of that work once up front. compile turns a resolved program (see
+# language.resolve for the layout of runtime frames) into a tree of nested
+# python closures, each of which takes a runtime frame and returns a value.
+# Globals are looked up once at compile time and become constants.
+
+
+class CompiledProcedure(object):
+    """A lambda closed over a runtime frame"""
+
+    def __init__(self, node, code, frame_size, env):
+        self.node, self.code, self.frame_size, self.env = node, code, frame_size, env
+
+    def __call__(self, arg):
+        frame = [None] * self.frame_size
+        frame[0] = self.env
+        frame[1] = arg
+        return self.code(frame)
+
+    def __str__(self):
+        return str(self.node)
+
+
+class CompiledProgram(object):
+    """An AST which has been compiled to closures by compile
+
+    Call it with one value for each name in env_shape, in the same order.
+    """
+
+    def __init__(self, node, env_shape, code, frame_size):
+        self.node = node
+        self.env_shape = tuple(env_shape)
+        self.code = code
+        self.frame_size = frame_size
+
+    def __call__(self, *args):
+        if len(args) != len(self.env_shape):
+            raise TypeError(f"Expected {len(self.env_shape)} arguments "
+                            f"{self.env_shape}, got {len(args)}")
+        frame = [None] * self.frame_size
+        frame[1:len(args) + 1] = args
+        return self.code(frame)
+
+    def __str__(self):
+        return f"(fn {', '.join(self.env_shape)} => {self.node})"
+
+
+def compile(node, env_shape, env={}):
+    """Compiles an AST into a CompiledProgram
+
+    Args:
+        node: The root of the abstract syntax tree
+        env_shape: The names of the variables that will be supplied each time
+            the program is called (for instance ["grid"])
+        env: The global environment, a mapping from names to values. Globals
+            are looked up once at compile time, so later changes to env are
+            not seen by the compiled program
+
+    Returns:
+        A CompiledProgram
+
+    Raises:
+        ParseError: The program contains an undefined symbol or a malformed
+            special form
+    """
+    program = resolve(node, env_shape, env)
+    code = compile_node(program.root, program.get_globals(env))
+    return CompiledProgram(node, env_shape, code, program.frame_size)
+
+
+def compile_node(x, globals_):
+    """returns a closure which evaluates resolved node x given a runtime frame"""
+    if isinstance(x, (Global, Constant)):
+        value = get_constant(x, globals_)
+        return lambda frame: value
+
+    elif isinstance(x, Local):
+        return compile_local(x.depth, x.slot)
+
+    elif isinstance(x, Call):
+        args = [compile_node(a, globals_) for a in x.args]
+
+        # if the function is a primitive, we can skip evaluating it at runtime
+        if isinstance(x.fn, (Global, Constant)):
+            proc = get_constant(x.fn, globals_)
+            if len(args) == 1:
+                arg, = args
+                return lambda frame: proc(arg(frame))
+            else:
+                return lambda frame: proc(*[a(frame) for a in args])
+
+        fn = compile_node(x.fn, globals_)
+        if len(args) == 1:
+            arg, = args
+            return lambda frame: fn(frame)(arg(frame))
+        else:
+            return lambda frame: fn(frame)(*[a(frame) for a in args])
+
+    elif isinstance(x, Cond):
+        pred = compile_node(x.pred, globals_)
+        a = compile_node(x.x, globals_)
+        b = compile_node(x.y, globals_)
+        return lambda frame: a(frame) if pred(frame) else b(frame)
+
+    elif isinstance(x, Closure):
+        body = compile_node(x.body, globals_)
+        node, frame_size = x.node, x.frame_size
+        return lambda frame: CompiledProcedure(node, body, frame_size, frame)
+
+    elif isinstance(x, Bind):
+        slot = x.slot
+        defn = compile_node(x.defn, globals_)
+        body = compile_node(x.body, globals_)
+        def bind(frame):
+            frame[slot] = defn(frame)
+            return body(frame)
+        return bind
+
+    assert 0, f"Unhandled resolved node {type(x)}"
+
+
+def get_constant(x, globals_):
+    """get the value of a Global or Constant at compile time"""
+    if isinstance(x, Global):
+        return globals_[x.index]
+    else:
+        return x.value
+
+
+def compile_local(depth, slot):
+    """returns a closure which reads a slot from an enclosing frame"""
+    if depth == 0:
+        return lambda frame: frame[slot]
+    elif depth == 1:
+        return lambda frame: frame[0][slot]
+    elif depth == 2:
+        return lambda frame: frame[0][0][slot]
+    else:
+        def read(frame):
+            for _ in range(depth):
+                frame = frame[0]
+            return frame[slot]
+        return read
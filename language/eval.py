@@ -1,24 +1,15 @@
-from copy import deepcopy
-import numpy as np
+import weakref
 
-from language.ast import Identifier, Apply, Lambda, Let, Letrec
-from language.util import is_integer_literal, is_color_literal, ParseError
-
-
-def get_identifier(name, env):
-    """get the value of an identifier"""
-
-    val = env.get(name)
-    if val != None:
-        return val
-    elif is_integer_literal(name):
-        return int(name)
-    elif is_color_literal(name):
-        return name # NOTE(izzy): decide how to represent colors? probably int
-    else:
-        raise ParseError(f"Undefined symbol {name}")
+from language.ast import Letrec
+from language.batch import Batch
+from language.resolve import resolve, Local, Global, Constant, Call, Cond, Closure, Bind
 
 
+# NOTE(izzy): NestedEnv used to be the runtime representation of scopes.
+# Evaluation now runs on programs that have been through language.resolve, in
+# which every local variable lives in a slot of a list-based frame and every
+# global has an index, so no dict lookups happen at runtime. NestedEnv is kept
+# so that existing callers can still pass one as the environment to eval.
 class NestedEnv(dict):
     def __init__(self, dictionary, outer=None):
         self.update(dictionary)
@@ -60,78 +51,310 @@ class NestedEnv(dict):
 
 class Procedure(object):
     """A user-defined Scheme procedure."""
-    def __init__(self, param, body, env):
-        self.param, self.body, self.env = param, body, env
+    def __init__(self, closure, frame, globals_):
+        self.closure, self.frame, self.globals = closure, frame, globals_
 
     def __call__(self, arg):
-        # create a new environment with the argument bound to input
-        new_env = NestedEnv({self.param: arg}, outer=self.env)
-        # and evaluate the procedure in the new environment
-        return eval(self.body, new_env)
+        # create a new frame with the argument bound to slot 1
+        new_frame = [None] * self.closure.frame_size
+        new_frame[0] = self.frame
+        new_frame[1] = arg
+        # and evaluate the procedure in the new frame
+        return evaluate(self.closure.body, new_frame, self.globals)
 
     def __str__(self):
-        return f"(fn {self.param} => {self.body})"
+        return str(self.closure.node)
+
 
-def eval_cond(x, env):
-    """handles AST with Apply(Identifier('cond'), ...) at the root
+def evaluate(x, frame, globals_):
+    """evaluate a resolved node (see language.resolve)
 
-    we need to handle this outside of the default eval Apply because we only
-    want to compute the selected branch of an if statement (lazy eval). If we
-    don't do this, we can't use cond to terminate a recursive function.
+    Args:
+        x: A node of a resolved program
+        frame: The runtime frame (a list) that x is evaluated in
+        globals_: The values of the program's globals, in index order
     """
-    try:
-        pred, x, y = x.args
-    except ValueError:
-        raise ParseError(f"Wrong number of arguments to cond:\n{str(x)}")
-    return eval(x, env) if eval(pred, env) else eval(y, env)
+    if isinstance(x, Call):
+        proc = evaluate(x.fn, frame, globals_)
+        args = [evaluate(a, frame, globals_) for a in x.args]
+        return proc(*args)
+
+    elif isinstance(x, Local):
+        for _ in range(x.depth):
+            frame = frame[0]
+        return frame[x.slot]
+
+    elif isinstance(x, Global):
+        return globals_[x.index]
+
+    elif isinstance(x, Constant):
+        return x.value
+
+    elif isinstance(x, Cond):
+        if evaluate(x.pred, frame, globals_):
+            return evaluate(x.x, frame, globals_)
+        else:
+            return evaluate(x.y, frame, globals_)
+
+    elif isinstance(x, Closure):
+        return Procedure(x, frame, globals_)
+
+    elif isinstance(x, Bind):
+        # NOTE(izzy): for a Letrec, the slot is already in scope while the
+        # definition is evaluated. A lambda in the definition closes over this
+        # frame, so by the time the lambda is called, the slot has been filled
+        # and it can see itself
+        frame[x.slot] = evaluate(x.defn, frame, globals_)
+        return evaluate(x.body, frame, globals_)
+
+    assert 0, f"Unhandled resolved node {type(x)}"
+
+
+# marks a cache miss, since None is a value that can be cached
+missing = object()
+
+def evaluate_cached(x, frame, globals_, cache, example_id):
+    """evaluate a resolved node, sharing the values of subtrees through cache
+
+    Args:
+        x: A node of a resolved program
+        frame: The runtime frame (a list) that x is evaluated in
+        globals_: The values of the program's globals, in index order
+        cache: A language.cache.ExprCache
+        example_id: A hashable id for the program's arguments (and globals).
+            Cached values are only shared between evaluations with the same
+            example_id
+    """
+    # leaves are cheaper to evaluate than to look up, and anything that
+    # depends on a variable bound inside the program is skipped
+    if not getattr(x, "cacheable", False):
+        return evaluate_children_cached(x, frame, globals_, cache, example_id)
+
+    key = (x.node, example_id)
+    value = cache.get(key, missing)
+    if value is missing:
+        value = evaluate_children_cached(x, frame, globals_, cache, example_id)
+        cache.put(key, value)
+    return value
+
+
+def evaluate_children_cached(x, frame, globals_, cache, example_id):
+    """evaluate x, looking up its children with evaluate_cached"""
+    if isinstance(x, Call):
+        proc = evaluate_cached(x.fn, frame, globals_, cache, example_id)
+        args = [evaluate_cached(a, frame, globals_, cache, example_id) for a in x.args]
+        return proc(*args)
+
+    elif isinstance(x, Cond):
+        if evaluate_cached(x.pred, frame, globals_, cache, example_id):
+            return evaluate_cached(x.x, frame, globals_, cache, example_id)
+        else:
+            return evaluate_cached(x.y, frame, globals_, cache, example_id)
+
+    elif isinstance(x, Bind) and not isinstance(x.node, Letrec):
+        frame[x.slot] = evaluate_cached(x.defn, frame, globals_, cache, example_id)
+        return evaluate_cached(x.body, frame, globals_, cache, example_id)
+
+    # NOTE(izzy): nothing inside a lambda or a letrec is cached. A lambda's
+    # body is evaluated by Procedure every time it is called, and the
+    # definition in a letrec usually closes over its own binding
+    return evaluate(x, frame, globals_)
+
+
+def eval_resolved(program, args, env, cache=None, example_id=None):
+    """evaluate a ResolvedProgram
+
+    Resolving walks the whole tree, so if a program is going to be run many
+    times (for instance once per train pair), resolve it once and call this.
+
+    Args:
+        program: A ResolvedProgram
+        args: The values of the names in program.env_shape
+        env: The global environment (a dict or NestedEnv)
+        cache: An optional language.cache.ExprCache. Subtrees which only
+            depend on args are looked up in the cache before they are
+            evaluated
+        example_id: A hashable id for args, required if cache is given. Two
+            calls with the same example_id must have the same args and env
+    """
+    frame = program.make_frame(args)
+    globals_ = program.get_globals(env)
+    if cache is None:
+        return evaluate(program.root, frame, globals_)
+    return evaluate_cached(program.root, frame, globals_, cache, example_id)
+
 
+# resolved programs, keyed by the AST they were resolved from (and then by
+# env_shape), so that evaluating the same AST again doesn't resolve it again
+resolved_programs = weakref.WeakKeyDictionary()
 
-def get_special_eval(x):
-    """non-standard evaluation (particularly for higher order functions"""
-    if isinstance(x, Apply) and isinstance(x.fn, Identifier) and x.fn.name == "cond":
-        return eval_cond
+def get_resolved(x, env_shape, env):
+    """resolve x, reusing the last resolution if it is still valid for env"""
+    programs = resolved_programs.setdefault(x, {})
+    program = programs.get(env_shape)
+    if program is None or not program.valid_for(env):
+        program = resolve(x, env_shape, env)
+        programs[env_shape] = program
+    return program
+
+
+def eval(x, env, cache=None, example_id=None):
+    """evaluate an AST in an environment
+
+    Args:
+        x: The root of the abstract syntax tree
+        env: A dict or NestedEnv mapping names to values
+        cache: An optional language.cache.ExprCache to share the values of
+            subtrees between calls
+        example_id: A hashable id for env, required if cache is given. Two
+            calls with the same example_id must have the same env
+    """
+    return eval_resolved(get_resolved(x, (), env), (), env, cache, example_id)
+
+
+class BatchedPartial(object):
+    """A primitive with a batched implementation, partially applied
+
+    Curried primitives are applied one argument at a time, so eval_batch
+    collects the arguments here until it has all of them, and then calls the
+    batched implementation once.
+    """
+    def __init__(self, proc, args):
+        self.proc, self.args = proc, args
+
+    def apply(self, args, n):
+        args = self.args + args
+        if len(args) < self.proc.arity:
+            return BatchedPartial(self.proc, args)
+
+        result = self.proc.batched(*args[:self.proc.arity])
+        if result is NotImplemented:
+            result = call_each(self.proc, args[:self.proc.arity], n)
+        if len(args) > self.proc.arity:
+            result = apply_batch(result, args[self.proc.arity:], n)
+        return result
+
+    def unbatch(self, n):
+        """the value of the partial application, as eval would compute it"""
+        return call_each(self.proc, self.args, n)
+
+
+def call_each(proc, args, n):
+    """apply the curried proc to args (one at a time) separately per input"""
+    proc = unbatch(proc, n)
+    args = [unbatch(a, n) for a in args]
+    if not any(isinstance(v, Batch) for v in [proc] + args):
+        for a in args:
+            proc = proc(a)
+        return proc
+
+    results = []
+    for i in range(n):
+        p = proc.values[i] if isinstance(proc, Batch) else proc
+        for a in args:
+            p = p(a.values[i] if isinstance(a, Batch) else a)
+        results.append(p)
+    return Batch(results)
+
+
+def unbatch(x, n):
+    """turn a BatchedPartial into the value eval_batch would have produced"""
+    if isinstance(x, BatchedPartial):
+        return x.unbatch(n)
+    return x
+
+
+def apply_batch(proc, args, n):
+    if isinstance(proc, BatchedPartial):
+        return proc.apply(args, n)
+    elif not isinstance(proc, Batch) and hasattr(proc, "batched"):
+        return BatchedPartial(proc, []).apply(args, n)
+    elif len(args) == 1:
+        return call_each(proc, args, n)
     else:
+        # a non-curried function of several arguments
+        proc = unbatch(proc, n)
+        args = [unbatch(a, n) for a in args]
+        if not any(isinstance(v, Batch) for v in [proc] + args):
+            return proc(*args)
+        return Batch([(proc.values[i] if isinstance(proc, Batch) else proc)(
+            *[a.values[i] if isinstance(a, Batch) else a for a in args]) for i in range(n)])
+
+
+def select_frame(frame, i):
+    """the frame seen by input i, with every Batch replaced by its ith value"""
+    if frame is None:
         return None
+    new_frame = [v.values[i] if isinstance(v, Batch) else v for v in frame]
+    new_frame[0] = select_frame(frame[0], i)
+    return new_frame
 
 
-def eval(x, env):
-    # if the environment is a regular dictionary, wrap it in a class
-    # which supports nested dictionaries (for local scoping)
-    if not isinstance(env, NestedEnv): env = NestedEnv(env)
+def evaluate_batch(x, frame, globals_, n):
+    """evaluate a resolved node once for all n inputs
 
-    # some higher-order-functions require a special evaluation structure
-    special_eval = get_special_eval(x)
-    if special_eval is not None:
-        return special_eval(x, env)
+    Values which depend on the input are represented as a Batch. Anything we
+    can't (or don't want to) evaluate for the whole batch at once is evaluated
+    separately for each input with evaluate.
+    """
+    if isinstance(x, Call):
+        proc = evaluate_batch(x.fn, frame, globals_, n)
+        args = [evaluate_batch(a, frame, globals_, n) for a in x.args]
+        return apply_batch(proc, args, n)
 
-    elif isinstance(x, Identifier):
-        return get_identifier(x.name, env)
+    elif isinstance(x, Local):
+        for _ in range(x.depth):
+            frame = frame[0]
+        return frame[x.slot]
 
-    elif isinstance(x, Apply):
-        proc = eval(x.fn, env)
-        args = [eval(a, env) for a in x.args]
-        return proc(*args)
+    elif isinstance(x, Global):
+        return globals_[x.index]
+
+    elif isinstance(x, Constant):
+        return x.value
+
+    elif isinstance(x, Cond):
+        pred = unbatch(evaluate_batch(x.pred, frame, globals_, n), n)
+        if not isinstance(pred, Batch):
+            return evaluate_batch(x.x if pred else x.y, frame, globals_, n)
+        # the branch depends on the input, so evaluate each input separately
+        return Batch([evaluate(x.x if p else x.y, select_frame(frame, i), globals_)
+                      for i, p in enumerate(pred.values)])
 
-    elif isinstance(x, Lambda):
-        return Procedure(x.v, x.body, env)
-
-    elif isinstance(x, Let):
-        # NOTE(izzy): this implementation is more efficient the Letrec, because
-        # it doesn't copy the environment, but it doesn't support recursion.
-        # The reason recursion won't work is because to create the new
-        # environment which we pass to the body, we need to `exp`, the
-        # variable to be bound in the new environment. In the case where we are
-        # defining a recursive function, exp needs access to itself
-        var = x.v
-        val = eval(x.defn, env)
-        new_env = NestedEnv({var: val}, outer=env)
-        return eval(x.body, env=new_env)
-
-    elif isinstance(x, Letrec):
-        # NOTE(izzy): this implementation does support recursion, but it copies
-        # the environment every time which isn't great
-        new_env = deepcopy(env)
-        var = x.v
-        val = eval(x.defn, new_env)
-        new_env[var] = val
-        return eval(x.body, env=new_env)
+    elif isinstance(x, Bind) and not isinstance(x.node, Letrec):
+        frame[x.slot] = evaluate_batch(x.defn, frame, globals_, n)
+        return evaluate_batch(x.body, frame, globals_, n)
+
+    # NOTE(izzy): lambdas and letrecs are evaluated separately for each input.
+    # A lambda closes over its frame, so it needs a frame that belongs to a
+    # single input. (For a letrec, the recursive function has to close over
+    # the same frame that the binding is put into, so the whole letrec is
+    # evaluated per input)
+    return Batch([evaluate(x, select_frame(frame, i), globals_) for i in range(n)])
+
+
+def eval_batch(x, grids, env, var="grid"):
+    """evaluate an AST on many inputs at once
+
+    The program is interpreted once per node (rather than once per node per
+    input), and primitives with a batched implementation (see language.v1.make)
+    are applied to all of the inputs in a single call.
+
+    Args:
+        x: The root of the abstract syntax tree
+        grids: A list of inputs
+        env: The global environment (a dict or NestedEnv)
+        var: The name that each input is bound to
+
+    Returns:
+        A list with the result for each input, the same as
+        [eval(x, {**env, var: g}) for g in grids]
+    """
+    n = len(grids)
+    program = get_resolved(x, (var,), env)
+    frame = program.make_frame([Batch(list(grids))])
+    result = unbatch(evaluate_batch(program.root, frame, program.get_globals(env), n), n)
+    if isinstance(result, Batch):
+        return result.values
+    else:
+        return [result] * n
@@ -0,0 +1,123 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+
+Compares the tree-walking evaluator (language.eval.eval) against programs
+compiled to closures (language.compile.compile), against evaluating all of
+the grids at once (language.eval.eval_batch), and against sharing subtrees
+between programs with a language.cache.ExprCache. Run from the repo root with
+
+    python -m language.eval_benchmark
+"""
+import numpy as np
+from timeit import timeit
+
+from language.ast import Identifier, Apply, Let
+from language.cache import ExprCache
+from language.compile import compile
+from language.eval import eval, eval_batch, NestedEnv
+from language.eval_example import my_env, examples
+from language.v1 import eval_env
+
+
+# let g = trans grid in eq g (trans (trans g))
+grid_program = Let("g", Apply(Identifier("trans"), Identifier("grid")),
+    Apply(Apply(Identifier("eq"), Identifier("g")),
+          Apply(Identifier("trans"), Apply(Identifier("trans"), Identifier("g")))))
+
+
+def check_same(a, b):
+    if isinstance(a, list):
+        return len(a) == len(b) and all(check_same(x, y) for x, y in zip(a, b))
+    elif isinstance(a, np.ndarray):
+        return a.shape == b.shape and (a == b).all()
+    else:
+        return a == b
+
+
+def benchmark(name, run_eval, run_fast, number):
+    assert check_same(run_eval(), run_fast()), f"{name}: results differ"
+    eval_time = timeit(run_eval, number=number) / number
+    fast_time = timeit(run_fast, number=number) / number
+    print(f"{name}\n\teval:\t\t{eval_time * 1e6:.1f}us"
+          f"\n\tfast:\t\t{fast_time * 1e6:.1f}us"
+          f"\n\tspeedup:\t{eval_time / fast_time:.1f}x")
+
+
+def benchmark_examples(number=10000):
+    for example in examples:
+        program = compile(example, [], my_env)
+        benchmark(str(example),
+                  lambda: eval(example, my_env),
+                  lambda: program(),
+                  number)
+
+
+def benchmark_grids(number=10000, num_grids=10):
+    grids = [np.random.randint(10, size=np.random.randint(1, 30, size=2), dtype=np.uint8)
+             for _ in range(num_grids)]
+    # the compiled program is built once and then called on each grid, which
+    # is how we use it when scoring a candidate against every train pair
+    program = compile(grid_program, ["grid"], eval_env)
+    benchmark(f"{grid_program} on {num_grids} grids",
+              lambda: [eval(grid_program, {**eval_env, "grid": g}) for g in grids],
+              lambda: [program(g) for g in grids],
+              number // num_grids)
+
+
+def benchmark_batch(number=1000, num_grids=10):
+    grids = [np.random.randint(10, size=np.random.randint(1, 30, size=2), dtype=np.uint8)
+             for _ in range(num_grids)]
+    for program in [grid_program, Apply(Apply(Identifier("plus"),
+            Apply(Identifier("zeros_like"), Identifier("grid"))), Identifier("grid"))]:
+        benchmark(f"{program} on {num_grids} grids (batched)",
+                  lambda: [eval(program, {**eval_env, "grid": g}) for g in grids],
+                  lambda: eval_batch(program, grids, eval_env),
+                  number)
+
+
+def benchmark_cache(number=10, num_grids=10, depth=20, num_mutants=20):
+    """evaluate many mutants of a program, which share a large subtree"""
+    grids = [np.random.randint(10, size=np.random.randint(1, 30, size=2), dtype=np.uint8)
+             for _ in range(num_grids)]
+    shared = Identifier("grid")
+    for _ in range(depth):
+        shared = Apply(Identifier("trans"), Apply(Apply(Identifier("plus"), Identifier("1")), shared))
+    mutants = [Apply(Apply(Identifier("eq"), shared),
+                     Apply(Apply(Identifier("plus"), Identifier(str(i))), Identifier("grid")))
+               for i in range(num_mutants)]
+
+    def run_cached():
+        # a new cache every time, so we only count the sharing between mutants
+        cache = ExprCache()
+        return [eval(m, {**eval_env, "grid": g}, cache, i)
+                for m in mutants for i, g in enumerate(grids)]
+
+    benchmark(f"{num_mutants} mutants sharing a subtree of size {shared.size} "
+              f"on {num_grids} grids (cached)",
+              lambda: [eval(m, {**eval_env, "grid": g})
+                       for m in mutants for g in grids],
+              run_cached,
+              number)
+
+
+def benchmark_letrec(number=1000, env_sizes=(0, 10, 100, 1000)):
+    """the cost of a Letrec should not depend on the size of the environment"""
+    factorial_program = examples[1]
+    print(factorial_program)
+    for env_size in env_sizes:
+        env = {f"grid_{i}": np.zeros((30, 30), dtype=np.uint8) for i in range(env_size)}
+        env.update(my_env)
+        # wrap the environment once so that we are only timing the Letrec,
+        # rather than eval copying a plain dict into a NestedEnv
+        env = NestedEnv(env)
+        t = timeit(lambda: eval(factorial_program, env), number=number) / number
+        print(f"\t{env_size} extra bindings:\t{t * 1e6:.1f}us")
+
+
+if __name__ == '__main__':
+    benchmark_examples()
+    benchmark_grids()
+    benchmark_batch()
+    benchmark_cache()
+    benchmark_letrec()
@@ -1,4 +1,5 @@
 from language.eval import eval
+from language.compile import compile
 from language.ast import Identifier, Apply, Lambda, Let, Letrec
 
 my_env = {"pred": lambda x: x - 1,
@@ -24,11 +25,15 @@ factorial_program = Letrec("factorial",  # letrec factorial =
         ),  # in
     Apply(Identifier("factorial"), Identifier("5")))
 
-# print(one_plus_one)
-# print(eval(one_plus_one, my_env))
-print(factorial_program)
-try:
-    print(eval(factorial_program, my_env))
-except Exception as e:
-    print(e)
-    print("blyat")
+examples = [one_plus_one, factorial_program]
+
+
+if __name__ == '__main__':
+    for example in examples:
+        print(example)
+        try:
+            print(f"eval:\t{eval(example, my_env)}")
+            print(f"compile:\t{compile(example, [], my_env)()}")
+        except Exception as e:
+            print(e)
+            print("blyat")
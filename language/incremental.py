@@ -0,0 +1,189 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+import weakref
+
+from language.ast import Identifier, Apply, Lambda, Let, Letrec, Hole, replace_subtree
+from language.substitution import Substitution
+from language.type_inference import get_type, unify, lookup, curry_lambda, uncurry_type
+from language.types import TypeVariable, TypeOperator, Function
+from language.util import InferenceError, ParseError
+
+
+# NOTE(izzy): during search we type check lots of programs which only differ
+# from a program we have already checked in one subtree. Running analyse on
+# the whole program again repeats all of the work for the subtrees that
+# didn't change.
+#
+# The type of a closed subtree (one that doesn't refer to any variable bound
+# by an enclosing Lambda, Let or Letrec) doesn't depend on where it appears:
+# inferring it in place gives the same type as inferring it on its own, with
+# fresh type variables. So the IncrementalChecker infers the type of each
+# closed subtree once, and caches it keyed by the (hash-consed) node. When a
+# parent needs the type of a closed child, it gets a copy of the cached type
+# with new type variables. Since replacing a subtree only creates new nodes
+# along the path from the root to the replaced subtree (see
+# language.ast.replace_subtree), checking the new program only infers the
+# types of the nodes on that path, the new subtree, and any children of
+# those that aren't closed.
+#
+# Make sure the names of the program's inputs are in the type environment
+# (for instance {**type_env, "grid": Integer_array_2}), rather than bound by
+# a Lambda around the whole program, otherwise no subtree that uses the
+# input is closed.
+
+
+def instantiate(t, mappings=None):
+    """a copy of t with every TypeVariable replaced by a new one"""
+    if mappings is None:
+        mappings = {}
+    if isinstance(t, TypeVariable):
+        if t not in mappings:
+            mappings[t] = TypeVariable()
+        return mappings[t]
+    types = [instantiate(x, mappings) for x in t.types]
+    if all(a is b for a, b in zip(types, t.types)):
+        return t
+    return TypeOperator(t.name, types)
+
+
+class IncrementalChecker(object):
+    """Type checks programs, reusing the types of subtrees it has already seen
+
+    Args:
+        env: The type environment, a mapping from names to types. Type
+            variables in env are treated as generic (as in analyse with no
+            non_generic variables)
+    """
+
+    def __init__(self, env):
+        self.env = env
+        # the type (or the error) of each closed subtree, fully resolved
+        self.types = weakref.WeakKeyDictionary()
+        # the names each subtree refers to, but doesn't bind
+        self.free = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, node):
+        """the type of node
+
+        Raises:
+            InferenceError: The program doesn't type check
+            ParseError: The program contains an undefined symbol
+        """
+        entry = self.types.get(node)
+        if entry is None:
+            self.misses += 1
+            subst = Substitution()
+            try:
+                entry = lookup(self.infer(node, self.env, set(), subst, frozenset()), subst)
+            except (InferenceError, ParseError) as e:
+                entry = e
+            self.types[node] = entry
+        else:
+            self.hits += 1
+
+        if isinstance(entry, Exception):
+            raise entry.with_traceback(None)
+        return entry
+
+    def check_replacement(self, node, path, new_subtree):
+        """replace the subtree of node at path, and type check the result
+
+        Returns:
+            The new program and its type
+
+        Raises:
+            InferenceError: The new program doesn't type check
+            ParseError: The new program contains an undefined symbol
+        """
+        new_node = replace_subtree(node, path, new_subtree)
+        return new_node, self.check(new_node)
+
+    def is_valid(self, node):
+        """whether node type checks"""
+        try:
+            self.check(node)
+            return True
+        except (InferenceError, ParseError):
+            return False
+
+    def free_names(self, node):
+        names = self.free.get(node)
+        if names is None:
+            if isinstance(node, Identifier):
+                names = frozenset([node.name])
+            elif isinstance(node, Apply):
+                names = frozenset().union(*[self.free_names(c) for c in node.children])
+            elif isinstance(node, Lambda):
+                bound = {node.v} if isinstance(node.v, str) else set(node.v)
+                names = self.free_names(node.body) - bound
+            elif isinstance(node, Let):
+                names = self.free_names(node.defn) | (self.free_names(node.body) - {node.v})
+            elif isinstance(node, Letrec):
+                names = (self.free_names(node.defn) | self.free_names(node.body)) - {node.v}
+            elif isinstance(node, Hole):
+                names = frozenset()
+            else:
+                assert 0, f"Unhandled syntax node {type(node)}"
+            self.free[node] = names
+        return names
+
+    def infer_child(self, node, env, non_generic, subst, bound):
+        """the type of a child node, from the cache if it is closed"""
+        if isinstance(node, Identifier) or self.free_names(node) & bound:
+            return self.infer(node, env, non_generic, subst, bound)
+        return instantiate(self.check(node))
+
+    def infer(self, node, env, non_generic, subst, bound):
+        """language.type_inference.infer, but the types of closed children
+        come from the cache. bound is the set of names bound by enclosing
+        Lambdas, Lets and Letrecs"""
+        if isinstance(node, Identifier):
+            return get_type(node.name, env, non_generic, subst)
+
+        elif isinstance(node, Apply):
+            fun_type = self.infer_child(node.fn, env, non_generic, subst, bound)
+            arg_types = [self.infer_child(arg, env, non_generic, subst, bound)
+                         for arg in node.args]
+            result_type = TypeVariable()
+            unify(Function(*arg_types, result_type), fun_type, subst)
+            return result_type
+
+        elif isinstance(node, Lambda):
+            if isinstance(node.v, str):
+                arg_type = TypeVariable()
+                new_env = env.copy()
+                new_env[node.v] = arg_type
+                new_non_generic = non_generic.copy()
+                new_non_generic.add(arg_type)
+                result_type = self.infer_child(node.body, new_env, new_non_generic,
+                                               subst, bound | {node.v})
+                return Function(arg_type, result_type)
+            else:
+                curried_type = self.infer(curry_lambda(node), env, non_generic, subst, bound)
+                return uncurry_type(curried_type)
+
+        elif isinstance(node, Let):
+            defn_type = self.infer_child(node.defn, env, non_generic, subst, bound)
+            new_env = env.copy()
+            new_env[node.v] = defn_type
+            return self.infer_child(node.body, new_env, non_generic, subst, bound | {node.v})
+
+        elif isinstance(node, Letrec):
+            new_type = TypeVariable()
+            new_env = env.copy()
+            new_env[node.v] = new_type
+            new_non_generic = non_generic.copy()
+            new_non_generic.add(new_type)
+            defn_type = self.infer_child(node.defn, new_env, new_non_generic,
+                                         subst, bound | {node.v})
+            unify(new_type, defn_type, subst)
+            return self.infer_child(node.body, new_env, non_generic, subst, bound | {node.v})
+
+        elif isinstance(node, Hole):
+            return TypeVariable()
+
+        assert 0, f"Unhandled syntax node {type(node)}"
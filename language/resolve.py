@@ -0,0 +1,299 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+
+from language.ast import Identifier, Apply, Lambda, Let, Letrec, Hole
+from language.util import is_integer_literal, is_color_literal, ParseError
+
+
+# NOTE(izzy): looking up an identifier in a NestedEnv walks the chain of outer
+# environments doing a dict probe at every level, and the global environment
+# is at the bottom of every chain. But because the language is lexically
+# scoped, we know at parse time exactly which binding every identifier refers
+# to. resolve does that work once, and produces a tree in which every
+# identifier has been replaced by an address:
+#
+#     Local(depth, slot): a variable bound by a Lambda, Let or Letrec. depth
+#         is the number of frames to walk up, and slot is the index in that
+#         frame
+#     Global(index): an entry in the environment passed to the program. The
+#         values of the globals are passed in as a list at runtime
+#     Constant(value): an integer or color literal
+#
+# At runtime, a frame is a python list. frame[0] holds the enclosing (parent)
+# frame, and the rest of the list holds the values of the variables bound in
+# that frame. A new frame is created for every call to a lambda (and one for
+# the program itself). Let and Letrec don't create new frames -- they just
+# fill a slot in the frame they are evaluated in.
+#
+# Each resolved node also records the bindings (frame, slot) of the variables
+# it refers to but doesn't bind itself, in free. Call, Cond and Bind nodes
+# are marked cacheable if the only variables they refer to are the program's
+# own arguments, which means their value is determined by the arguments and
+# the globals. language.eval uses that to share the values of subtrees between
+# programs (see language.cache).
+
+
+no_bindings = frozenset()
+
+
+class Local(object):
+    """A variable bound in an enclosing frame"""
+
+    def __init__(self, node, depth, slot, binding):
+        self.node, self.depth, self.slot = node, depth, slot
+        self.free = frozenset([binding])
+
+
+class Global(object):
+    """A variable bound in the global environment"""
+
+    def __init__(self, node, index):
+        self.node, self.index = node, index
+        self.free = no_bindings
+
+
+class Constant(object):
+    """An integer or color literal"""
+
+    def __init__(self, node, value):
+        self.node, self.value = node, value
+        self.free = no_bindings
+
+
+class Call(object):
+    """Function application"""
+
+    def __init__(self, node, fn, args):
+        self.node, self.fn, self.args = node, fn, args
+        self.free = fn.free.union(*[a.free for a in args])
+        self.cacheable = False
+
+
+class Cond(object):
+    """Conditional, which only evaluates the selected branch"""
+
+    def __init__(self, node, pred, x, y):
+        self.node, self.pred, self.x, self.y = node, pred, x, y
+        self.free = pred.free | x.free | y.free
+        self.cacheable = False
+
+
+class Closure(object):
+    """Lambda abstraction. Creates a frame of frame_size when called"""
+
+    def __init__(self, node, body, frame, frame_size):
+        self.node, self.body, self.frame_size = node, body, frame_size
+        self.free = frozenset(b for b in body.free if b[0] is not frame)
+
+
+class Bind(object):
+    """Let or Letrec. Fills slot in the current frame, then evaluates body"""
+
+    def __init__(self, node, binding, defn, body):
+        self.node, self.slot, self.defn, self.body = node, binding[1], defn, body
+        self.free = (defn.free | body.free) - {binding}
+        self.cacheable = False
+
+
+class ResolvedProgram(object):
+    """The result of resolve
+
+    Args:
+        node: The AST that was resolved
+        root: The root of the resolved tree
+        env_shape: The names bound in slots 1...n of the program's frame
+        global_names: The names of the globals, in the order of their index
+        literal_names: The identifiers that were resolved as literals
+        frame_size: The size of the program's frame
+    """
+
+    def __init__(self, node, root, env_shape, global_names, literal_names, frame_size):
+        self.node = node
+        self.root = root
+        self.env_shape = tuple(env_shape)
+        self.global_names = global_names
+        self.literal_names = literal_names
+        self.frame_size = frame_size
+
+    def make_frame(self, args):
+        """creates the program's frame, with args in slots 1...n"""
+        frame = [None] * self.frame_size
+        frame[1:len(args) + 1] = args
+        return frame
+
+    def get_globals(self, env):
+        """look up the values of the globals in env"""
+        return [env.get(name) for name in self.global_names]
+
+    def valid_for(self, env):
+        """checks whether resolving against env would give the same program"""
+        return all(env.get(name) is not None for name in self.global_names) \
+            and all(env.get(name) is None for name in self.literal_names)
+
+
+class Frame(object):
+    """resolve-time description of a runtime frame"""
+
+    def __init__(self):
+        self.size = 1  # slot 0 holds the parent frame
+
+    def allocate(self):
+        slot = self.size
+        self.size += 1
+        return slot
+
+
+class Scope(object):
+    """the names visible at some point in the program
+
+    Args:
+        frame: the Frame that new bindings are added to
+        names: a mapping from variable name to slot in the frame
+        outer: the Scope of the enclosing frame (or None)
+    """
+
+    def __init__(self, frame, names, outer=None):
+        self.frame = frame
+        self.names = names
+        self.outer = outer
+
+    def bind(self, name):
+        """returns a new scope with name bound to a new slot, and the binding"""
+        slot = self.frame.allocate()
+        names = self.names.copy()
+        names[name] = slot
+        return Scope(self.frame, names, self.outer), (self.frame, slot)
+
+    def find(self, name):
+        """returns the (depth, slot) address of name and its binding, or None"""
+        depth = 0
+        scope = self
+        while scope is not None:
+            if name in scope.names:
+                slot = scope.names[name]
+                return depth, slot, (scope.frame, slot)
+            scope = scope.outer
+            depth += 1
+        return None
+
+
+class Globals(object):
+    """assigns an index to each global referenced by the program
+
+    Args:
+        env: The global environment
+        arg_bindings: The bindings of the program's arguments
+    """
+
+    def __init__(self, env, arg_bindings):
+        self.env = env
+        self.arg_bindings = arg_bindings
+        self.indices = {}
+        self.literal_names = set()
+
+    def find(self, name):
+        """returns the index of name, or None if it isn't a global"""
+        if name in self.indices:
+            return self.indices[name]
+        # NOTE(izzy): env.get works for both dicts and NestedEnvs, and (like
+        # language.eval has always done) treats a binding to None as unbound
+        elif self.env.get(name) is not None:
+            self.indices[name] = len(self.indices)
+            return self.indices[name]
+        else:
+            return None
+
+    def mark_cacheable(self, x):
+        x.cacheable = x.free <= self.arg_bindings
+        return x
+
+
+def resolve(node, env_shape, env):
+    """Resolves every identifier in an AST to an address
+
+    Args:
+        node: The root of the abstract syntax tree
+        env_shape: The names that will be bound in the program's own frame
+            when it is run (for instance ["grid"])
+        env: The global environment. Only the names in env are used -- the
+            values are looked up when the program is run
+
+    Returns:
+        A ResolvedProgram
+
+    Raises:
+        ParseError: The program contains an undefined symbol or a malformed
+            special form
+    """
+    frame = Frame()
+    names = {name: frame.allocate() for name in env_shape}
+    globals_ = Globals(env, frozenset((frame, slot) for slot in names.values()))
+    root = resolve_node(node, Scope(frame, names), globals_)
+    return ResolvedProgram(node, root, env_shape, list(globals_.indices),
+                           list(globals_.literal_names), frame.size)
+
+
+def resolve_node(x, scope, globals_):
+    if isinstance(x, Identifier):
+        address = scope.find(x.name)
+        if address is not None:
+            return Local(x, *address)
+
+        index = globals_.find(x.name)
+        if index is not None:
+            return Global(x, index)
+        elif is_integer_literal(x.name):
+            globals_.literal_names.add(x.name)
+            return Constant(x, int(x.name))
+        elif is_color_literal(x.name):
+            globals_.literal_names.add(x.name)
+            return Constant(x, x.name) # NOTE(izzy): decide how to represent colors? probably int
+        else:
+            raise ParseError(f"Undefined symbol {x.name}")
+
+    elif isinstance(x, Apply):
+        # we need to handle cond separately because we only want to compute
+        # the selected branch of an if statement (lazy eval). If we don't do
+        # this, we can't use cond to terminate a recursive function.
+        if isinstance(x.fn, Identifier) and x.fn.name == "cond":
+            try:
+                pred, a, b = x.args
+            except ValueError:
+                raise ParseError(f"Wrong number of arguments to cond:\n{str(x)}")
+            return globals_.mark_cacheable(Cond(x, resolve_node(pred, scope, globals_),
+                                                   resolve_node(a, scope, globals_),
+                                                   resolve_node(b, scope, globals_)))
+
+        fn = resolve_node(x.fn, scope, globals_)
+        args = [resolve_node(a, scope, globals_) for a in x.args]
+        return globals_.mark_cacheable(Call(x, fn, args))
+
+    elif isinstance(x, Lambda):
+        body_frame = Frame()
+        body_scope = Scope(body_frame, {x.v: body_frame.allocate()}, outer=scope)
+        body = resolve_node(x.body, body_scope, globals_)
+        return Closure(x, body, body_frame, body_frame.size)
+
+    elif isinstance(x, Let):
+        # the definition is resolved before the variable is in scope, so it
+        # can't refer to itself
+        defn = resolve_node(x.defn, scope, globals_)
+        body_scope, binding = scope.bind(x.v)
+        return globals_.mark_cacheable(
+            Bind(x, binding, defn, resolve_node(x.body, body_scope, globals_)))
+
+    elif isinstance(x, Letrec):
+        # the definition is resolved with the variable already in scope. Any
+        # lambda in the definition closes over the frame, and so will see the
+        # slot once it is filled
+        body_scope, binding = scope.bind(x.v)
+        defn = resolve_node(x.defn, body_scope, globals_)
+        return globals_.mark_cacheable(
+            Bind(x, binding, defn, resolve_node(x.body, body_scope, globals_)))
+
+    elif isinstance(x, Hole):
+        raise ParseError("Can't run a program with holes in it")
+
+    assert 0, f"Unhandled syntax node {type(x)}"
@@ -0,0 +1,112 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+
+from language.types import TypeVariable
+
+
+# NOTE(izzy): type inference used to thread an immutable dict of bindings
+# (the "smush") through every call, copying it on every unify and
+# re-unifying every binding whenever two of them were combined, which made
+# inference quadratic (or worse) in the size of the program. A Substitution
+# is a single mutable union-find structure over TypeVariables instead: each
+# bound TypeVariable points at either another TypeVariable or a
+# TypeOperator, and find follows those pointers to the representative of the
+# variable's equivalence class, compressing the path as it goes. Binding a
+# variable is O(1), and looking one up is amortized close to O(1).
+#
+# The fully resolved form of a type (see language.type_inference.lookup) only
+# changes when a variable is bound (or a binding is undone), so resolved
+# types are cached until the version of the substitution changes.
+#
+# Every change (including the writes made by path compression) is recorded
+# on a trail, so that a search which tries out a constraint can undo it
+# again:
+#
+#     mark = subst.mark()
+#     try:
+#         unify(t1, t2, subst)
+#     except InferenceError:
+#         subst.undo(mark)
+
+
+class Substitution(object):
+    """A union-find mapping from TypeVariables to types, with undo"""
+
+    def __init__(self):
+        self.bindings = {}
+        self.trail = []
+        # incremented whenever a binding is added or removed
+        self.version = 0
+        self._resolved = {}
+        self._resolved_version = 0
+
+    def find(self, t):
+        """the representative of t: an unbound TypeVariable or a TypeOperator
+
+        Only the outermost type is resolved. The types inside a TypeOperator
+        may still be bound TypeVariables (see language.type_inference.lookup).
+        """
+        if not isinstance(t, TypeVariable) or t not in self.bindings:
+            return t
+
+        # find the root
+        root = self.bindings[t]
+        while isinstance(root, TypeVariable) and root in self.bindings:
+            root = self.bindings[root]
+
+        # and point everything on the path directly at it
+        while t is not root and isinstance(t, TypeVariable) and t in self.bindings:
+            parent = self.bindings[t]
+            if parent is not root:
+                self.trail.append((t, parent))
+                self.bindings[t] = root
+            t = parent
+
+        return root
+
+    def bind(self, v, t):
+        """bind the unbound TypeVariable v to t"""
+        assert v not in self.bindings, f"{v} is already bound"
+        self.trail.append((v, None))
+        self.bindings[v] = t
+        self.version += 1
+
+    def copy(self):
+        """a Substitution with the same bindings (and an empty trail)"""
+        subst = Substitution()
+        subst.bindings = self.bindings.copy()
+        return subst
+
+    def mark(self):
+        """a point in the history of the substitution that undo can return to"""
+        return len(self.trail)
+
+    def undo(self, mark):
+        """undo every change made since mark was taken"""
+        if len(self.trail) > mark:
+            self.version += 1
+        while len(self.trail) > mark:
+            v, old = self.trail.pop()
+            if old is None:
+                del self.bindings[v]
+            else:
+                self.bindings[v] = old
+
+    def resolved(self):
+        """a cache of resolved types, which is emptied whenever the bindings change"""
+        if self._resolved_version != self.version:
+            self._resolved = {}
+            self._resolved_version = self.version
+        return self._resolved
+
+    def items(self):
+        """the (TypeVariable, type) pairs of the bindings, in the order they were made"""
+        return self.bindings.items()
+
+    def __contains__(self, v):
+        return v in self.bindings
+
+    def __len__(self):
+        return len(self.bindings)
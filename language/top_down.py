@@ -0,0 +1,187 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+import heapq
+import itertools
+import numpy as np
+
+from language.ast import Identifier, Apply, Lambda, Hole, replace_subtree
+from language.compile import compile
+from language.incremental import instantiate
+from language.substitution import Substitution
+from language.type_inference import unify, lookup
+from language.types import TypeOperator, Integer
+from language.util import InferenceError
+from language.v1 import eval_env, type_env, Integer_array_2
+
+
+# NOTE(izzy): top-down search starts from a program which is nothing but a
+# hole of the type we want (fn grid => ? where ? : array(array(int))), and
+# repeatedly fills in the leftmost hole. A hole can only be filled with a
+# component (a primitive, a variable or a constant) applied to zero or more
+# new holes, such that the result type of the component unifies with the
+# type of the hole. The new holes get the types of the component's
+# arguments. So every partial program is well-typed, and every complete
+# program is too.
+#
+# The partial programs are kept in a priority queue ordered by cost (the
+# cost of the components used so far, plus the cost of each remaining hole),
+# so programs are completed cheapest first.
+
+
+class PartialProgram(object):
+    """A program which may contain holes
+
+    Args:
+        node: The AST, with Hole nodes in it
+        holes: The (path, type) of each hole in node, from left to right
+        subst: The Substitution the types of the holes are resolved in
+        cost: The cost of the components in node
+    """
+
+    def __init__(self, node, holes, subst, cost):
+        self.node, self.holes, self.subst, self.cost = node, holes, subst, cost
+
+    def is_complete(self):
+        return len(self.holes) == 0
+
+    def __str__(self):
+        return str(self.node)
+
+
+def arg_path(i, n):
+    """the path to the ith argument of a component applied to n arguments
+
+    ((f a0) a1) is Apply(Apply(f, a0), a1), so a1 is child 1 of the root, and
+    a0 is child 1 of child 0
+    """
+    return (0,) * (n - 1 - i) + (1,)
+
+
+def fillings(hole_type, subst, components):
+    """every way of filling a hole of hole_type
+
+    Yields:
+        (subtree, [(path, type)] of the new holes in subtree, cost, subst)
+    """
+    for name, component_type, cost in components:
+        t = instantiate(component_type)
+        arg_types = []
+        while True:
+            # try the component applied to len(arg_types) arguments
+            mark = subst.mark()
+            try:
+                unify(t, hole_type, subst)
+                new_subst = subst.copy()
+            except InferenceError:
+                new_subst = None
+            subst.undo(mark)
+
+            if new_subst is not None:
+                n = len(arg_types)
+                subtree = Identifier(name)
+                for _ in range(n):
+                    subtree = Apply(subtree, Hole())
+                holes = [(arg_path(i, n), arg_type) for i, arg_type in enumerate(arg_types)]
+                yield subtree, holes, cost, new_subst
+
+            if not (isinstance(t, TypeOperator) and t.name == "->" and len(t.types) == 2):
+                break
+            arg_types.append(t.types[0])
+            t = t.types[1]
+
+
+def expand(program, components, hole_cost):
+    """the partial programs made by filling the leftmost hole of program"""
+    (path, hole_type), rest = program.holes[0], program.holes[1:]
+    hole_type = lookup(hole_type, program.subst)
+    for subtree, new_holes, cost, subst in fillings(hole_type, program.subst, components):
+        node = replace_subtree(program.node, path, subtree)
+        holes = [(path + p, t) for p, t in new_holes] + rest
+        yield PartialProgram(node, holes, subst, program.cost + cost), \
+            program.cost + cost + hole_cost * len(holes)
+
+
+def make_components(types, var, var_type, constants, costs):
+    """(name, type, cost) for each primitive, the input, and each constant"""
+    components = [(name, t, costs.get(name, 1)) for name, t in types.items()]
+    components.append((var, var_type, costs.get(var, 1)))
+    components.extend((str(c), Integer, costs.get(str(c), 1)) for c in constants)
+    return components
+
+
+def best_first(components, start_type, var="grid", hole_cost=1, max_cost=15):
+    """yields every complete program (fn var => body) of start_type, cheapest first
+
+    Args:
+        components: The (name, type, cost) of everything a hole can be
+            filled with
+        start_type: The type of the body of the program
+        var: The name of the input
+        hole_cost: The cost of an unfilled hole (a lower bound on the cost
+            of whatever fills it)
+        max_cost: Partial programs which cost more than this are dropped
+
+    Yields:
+        (program, expansions), where expansions is the number of partial
+        programs that have been expanded so far
+    """
+    start = PartialProgram(Lambda(var, Hole()), [((0,), start_type)], Substitution(), 0)
+    counter = itertools.count()  # break ties in the order programs were made
+    queue = [(hole_cost, next(counter), start)]
+    expansions = 0
+    while queue:
+        _, _, program = heapq.heappop(queue)
+        if program.is_complete():
+            yield program.node, expansions
+            continue
+        expansions += 1
+        for child, priority in expand(program, components, hole_cost):
+            if priority <= max_cost:
+                heapq.heappush(queue, (priority, next(counter), child))
+
+
+def search(examples, max_expansions=100000, max_cost=15, env=eval_env,
+           types=type_env, var="grid", constants=range(10), costs={}):
+    """find the cheapest program which maps each input grid to its output
+
+    Args:
+        examples: A list of (input, output) pairs of grids
+        max_expansions: Give up after expanding this many partial programs
+        max_cost: The most expensive program to consider
+        env: The evaluation environment
+        types: The type environment of the primitives
+        var: The name of the input
+        constants: The integer literals a hole can be filled with
+        costs: The cost of each component, by name (the default is 1)
+
+    Returns:
+        The program (fn var => body) and the number of expansions. The
+        program is None if the search gave up
+    """
+    components = make_components(types, var, Integer_array_2, constants, costs)
+    expansions = 0
+    for program, expansions in best_first(components, Integer_array_2, var, max_cost=max_cost):
+        try:
+            f = compile(program.body, [var], env)
+            if all(np.array_equal(f(i), o) for i, o in examples):
+                return program, expansions
+        except Exception:
+            pass
+        if expansions >= max_expansions:
+            break
+    return None, expansions
+
+
+if __name__ == '__main__':
+    grids = [np.random.randint(10, size=np.random.randint(1, 10, size=2)) for _ in range(3)]
+
+    components = make_components(type_env, "grid", Integer_array_2, range(10), {})
+    print("The first few programs:")
+    for program, expansions in itertools.islice(best_first(components, Integer_array_2), 10):
+        print(f"\t{program}\t({expansions} expansions)")
+
+    examples = [(g, g.T) for g in grids]
+    program, expansions = search(examples)
+    print(f"Found {program} after {expansions} expansions")
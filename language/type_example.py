@@ -196,9 +196,12 @@ def test_holes():
     print()  # newline
 
     # the reason we return the smush, is so we can look up the type of other type
-    # variables as well. In this case we'll look up the type of HOLE
+    # variables as well. In this case we'll look up the type of HOLE. HOLE has to
+    # be non-generic, otherwise every use of it would get a fresh copy of its type
+    # variable (like the type variables in pair and cond), and HOLE itself would
+    # never be bound
     print(factorial_program_with_hole)
-    t, smush = analyse(factorial_program_with_hole, my_env)
+    t, smush = analyse(factorial_program_with_hole, my_env, {HOLE})
     for k,v in smush.items():
         print(f"{k} : {v}")
     print(f"Result:\ttype variable {t} has type {lookup(t, smush)}")
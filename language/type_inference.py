@@ -6,12 +6,13 @@ Based on an implementation by Robert Smallshire
 https://github.com/rob-smallshire/hindley-milner-python
 """
 
-from language.ast import Identifier, Apply, Lambda, Let, Letrec
+from language.ast import Identifier, Apply, Lambda, Let, Letrec, Hole
+from language.substitution import Substitution
 from language.types import *
 from language.util import is_integer_literal, is_color_literal, InferenceError, ParseError
 
 
-def analyse(node, env, non_generic=set(), parent_smush={}):
+def analyse(node, env, non_generic=None, subst=None):
     """Computes the type of the expression given by node.
 
     The type of the node is computed in the context of the
@@ -26,35 +27,39 @@ def analyse(node, env, non_generic=set(), parent_smush={}):
             to type assignments.
             to type assignments.
         non_generic: A set of non-generic variables, or None
+        subst: The Substitution to add the bindings to, or None to start with
+            an empty one. It is modified in place
 
     Returns:
-        The computed type of the expression.
+        The computed type of the expression, and the Substitution. Use
+        lookup(t, subst) to get the type with every bound variable replaced.
 
     Raises:
         InferenceError: The type of the expression could not be inferred, for example
             if it is not possible to unify two types such as Integer and Bool
         ParseError: The abstract syntax tree rooted at node could not be parsed
     """
+    if non_generic is None:
+        non_generic = set()
+    if subst is None:
+        subst = Substitution()
+    return infer(node, env, non_generic, subst), subst
 
+
+def infer(node, env, non_generic, subst):
+    """analyse, but only returns the type (the bindings are added to subst)"""
     if isinstance(node, Identifier):
-        return get_type(node.name, env, non_generic, parent_smush)
-
-    # NOTE(izzy): apply that considers all the arg types jointly
-    # elif isinstance(node, Apply):
-    #     print("Apply", node)
-    #     fun_type, fun_smush = analyse(node.fn, env, non_generic, parent_smush)
-    #     arg_types, arg_smushes = zip(*[analyse(arg, env, non_generic, parent_smush) for arg in node.args])
-    #     result_type = TypeVariable()
-    #     res_smush = unify(Function(*arg_types, result_type), fun_type, combine(fun_smush, *arg_smushes))
-    #     return result_type, res_smush
-
-    # apply which curries the arg types one at a time
+        return get_type(node.name, env, non_generic, subst)
+
+    # NOTE(izzy): the Function type we unify against has all of the arg
+    # types at once, so (f x y) only type checks if f is a function of two
+    # arguments, and ((f x) y) only if f is curried
     elif isinstance(node, Apply):
-        fun_type, fun_smush = analyse(node.fn, env, non_generic, parent_smush)
-        arg_types, arg_smushes = zip(*[analyse(arg, env, non_generic, parent_smush) for arg in node.args])
+        fun_type = infer(node.fn, env, non_generic, subst)
+        arg_types = [infer(arg, env, non_generic, subst) for arg in node.args]
         result_type = TypeVariable()
-        res_smush = unify(Function(*arg_types, result_type), fun_type, combine(fun_smush, *arg_smushes))
-        return result_type, res_smush
+        unify(Function(*arg_types, result_type), fun_type, subst)
+        return result_type
 
     elif isinstance(node, Lambda):
         if isinstance(node.v, str):
@@ -63,19 +68,18 @@ def analyse(node, env, non_generic=set(), parent_smush={}):
             new_env[node.v] = arg_type
             new_non_generic = non_generic.copy()
             new_non_generic.add(arg_type)
-            result_type, body_smush = analyse(node.body, new_env, new_non_generic, parent_smush)
-            return Function(arg_type, result_type), body_smush
+            result_type = infer(node.body, new_env, new_non_generic, subst)
+            return Function(arg_type, result_type)
         else:
             node = curry_lambda(node)
-            curried_type, body_smush = analyse(node, env, non_generic, parent_smush)
-            return uncurry_type(curried_type), body_smush
+            curried_type = infer(node, env, non_generic, subst)
+            return uncurry_type(curried_type)
 
     elif isinstance(node, Let):
-        defn_type, defn_smush = analyse(node.defn, env, non_generic, parent_smush)
+        defn_type = infer(node.defn, env, non_generic, subst)
         new_env = env.copy()
         new_env[node.v] = defn_type
-        body_type, body_smush = analyse(node.body, new_env, non_generic, parent_smush)
-        return body_type, combine(defn_smush, body_smush)
+        return infer(node.body, new_env, non_generic, subst)
 
     elif isinstance(node, Letrec):
         new_type = TypeVariable()
@@ -83,38 +87,41 @@ def analyse(node, env, non_generic=set(), parent_smush={}):
         new_env[node.v] = new_type
         new_non_generic = non_generic.copy()
         new_non_generic.add(new_type)
-        defn_type, defn_smush = analyse(node.defn, new_env, new_non_generic, parent_smush)
-        new_defn_smush = unify(new_type, defn_type, defn_smush)
-        body_type, body_smush = analyse(node.body, new_env, non_generic, combine(parent_smush, new_defn_smush))
-        return body_type, combine(new_defn_smush, body_smush)
+        defn_type = infer(node.defn, new_env, new_non_generic, subst)
+        unify(new_type, defn_type, subst)
+        return infer(node.body, new_env, non_generic, subst)
+
+    # a hole could be filled with something of any type
+    elif isinstance(node, Hole):
+        return TypeVariable()
 
     assert 0, f"Unhandled syntax node {type(node)}"
 
 
-def get_type(name, env, non_generic, smush):
+def get_type(name, env, non_generic, subst):
     """Get the type of identifier name from the type environment env.
 
     Args:
         name: The identifier name
         env: The type environment mapping from identifier names to types
         non_generic: A set of non-generic TypeVariables
+        subst: The current Substitution
 
     Raises:
         ParseError: Raised if name is an undefined symbol in the type
             environment.
     """
     if name in env:
-        # return lookup(env[name], smush)
-        return fresh(env[name], non_generic, smush)
+        return fresh(env[name], non_generic, subst)
     elif is_integer_literal(name):
-        return Integer, {}
+        return Integer
     elif is_color_literal(name):
-        return Color, {}
+        return Color
     else:
         raise ParseError(f"Undefined symbol {name}")
 
 
-def fresh(t, non_generic, smush):
+def fresh(t, non_generic, subst):
     """Makes a copy of a type expression.
 
     The type t is copied. The the generic variables are duplicated and the
@@ -123,32 +130,38 @@ def fresh(t, non_generic, smush):
     Args:
         t: A type to be copied.
         non_generic: A set of non-generic TypeVariables
+        subst: The current Substitution
     """
-    new_smush = {}  # A mapping of TypeVariables to TypeVariables
+    mappings = {}  # A mapping of TypeVariables to TypeVariables
 
     def freshrec(tp):
-        p = lookup(tp, smush)
+        p = subst.find(tp)
         if isinstance(p, TypeVariable):
-            if occurs_in(p, non_generic, smush):
-                # NOTE(izzy): non_generic type variables are ones that might be
-                # defined recurslively. If p is being defined recursively, we do
-                # not let it have multiple types within the defintion
-                return p
-            elif p not in new_smush:
-                # NOTE(izzy): see http://lucacardelli.name/Papers/BasicTypechecking.pdf
-                # bottom of page 10 for an explanation of why we do this. in short, if
-                # p is a polymorphic type, we want to allow p to take on diffent types
-                # in different contexts, so we give it a new typevariable
-                new_smush[p] = TypeVariable()
-
-            return new_smush[p]
+            if p not in mappings:
+                if occurs_in(p, non_generic, subst):
+                    # NOTE(izzy): non_generic type variables are ones that might be
+                    # defined recurslively. If p is being defined recursively, we do
+                    # not let it have multiple types within the defintion
+                    mappings[p] = p
+                else:
+                    # NOTE(izzy): see http://lucacardelli.name/Papers/BasicTypechecking.pdf
+                    # bottom of page 10 for an explanation of why we do this. in short, if
+                    # p is a polymorphic type, we want to allow p to take on diffent types
+                    # in different contexts, so we give it a new typevariable
+                    mappings[p] = TypeVariable()
+
+            return mappings[p]
         elif isinstance(p, TypeOperator):
-            return TypeOperator(p.name, [freshrec(x) for x in p.types])
+            types = [freshrec(x) for x in p.types]
+            # a type with no (generic) variables in it can be shared
+            if all(a is b for a, b in zip(types, p.types)):
+                return p
+            return TypeOperator(p.name, types)
 
-    return freshrec(t), new_smush
+    return freshrec(t)
 
 
-def unify(t1, t2, smush):
+def unify(t1, t2, subst):
     """Unify the two types t1 and t2.
 
     Makes the types t1 and t2 the same.
@@ -156,65 +169,71 @@ def unify(t1, t2, smush):
     Args:
         t1: The first type to be made equivalent
         t2: The second type to be be equivalent
+        subst: The Substitution to add the bindings to (in place)
 
     Returns:
-        smush
+        subst
 
     Raises:
-        InferenceError: Raised if the types cannot be unified.
+        InferenceError: Raised if the types cannot be unified. Any bindings
+            made before the mismatch was found are left in subst (see
+            Substitution.mark and Substitution.undo)
     """
-    a = lookup(t1, smush)
-    b = lookup(t2, smush)
-    new_smush = smush.copy()
+    a = subst.find(t1)
+    b = subst.find(t2)
     if isinstance(a, TypeVariable):
         if a != b:
-            if occurs_in_type(a, b, new_smush):
+            if occurs_in_type(a, b, subst):
                 raise InferenceError("recursive unification")
-            else: new_smush[a] = b
-        return new_smush
+            subst.bind(a, b)
     elif isinstance(a, TypeOperator) and isinstance(b, TypeVariable):
-        return unify(b, a, new_smush)
+        unify(b, a, subst)
     elif isinstance(a, TypeOperator) and isinstance(b, TypeOperator):
         if a.name != b.name or len(a.types) != len(b.types):
-            raise InferenceError(f"Type mismatch: {a} != {b}")
+            raise InferenceError(f"Type mismatch: {lookup(a, subst)} != {lookup(b, subst)}")
         for p, q in zip(a.types, b.types):
-            new_smush = unify(p, q, new_smush)
-        return new_smush
+            unify(p, q, subst)
     else:
         assert 0, "Not unified"
+    return subst
 
 
-def combine(*smushes):
-    new_smush = {}
-    for smush in smushes:
-        for k, v in smush.items():
-            new_smush = unify(k, v, new_smush)
-    return new_smush
-
-
-def lookup(a, smush):
+def lookup(a, subst):
     """Returns the currently defining instance of t.
 
-    As a side effect, collapses the list of type instances. The function lookup
-    is used whenever a type expression has to be inspected: it will always
-    return a type expression which is either an uninstantiated type variable or
-    a type operator; i.e. it will skip instantiated variables, and will
-    actually lookup them from expressions to remove long chains of instantiated
-    variables.
+    The function lookup is used whenever a type expression has to be
+    inspected: it will always return a type expression which is either an
+    uninstantiated type variable or a type operator; i.e. it will skip
+    instantiated variables (all the way down the type).
+
+    Types are only rebuilt where something underneath them is bound: if no
+    variable inside a is bound, a itself is returned. Resolved types are
+    cached in subst until its bindings change.
 
     Args:
         a: The type to be lookuped
+        subst: The current Substitution
 
     Returns:
         An uninstantiated TypeVariable or a TypeOperator
     """
-    if isinstance(a, TypeOperator):
-        return TypeOperator(a.name, [lookup(b, smush) for b in a.types])
+    a = subst.find(a)
+    if not isinstance(a, TypeOperator) or not a.types:
+        return a
+
+    resolved = subst.resolved()
+    if a in resolved:
+        return resolved[a]
+
+    types = [lookup(b, subst) for b in a.types]
+    if all(x is y for x, y in zip(types, a.types)):
+        result = a
     else:
-        try: return lookup(smush[a], smush)
-        except KeyError: return a
+        result = TypeOperator(a.name, types)
+    resolved[a] = result
+    return result
 
-def occurs_in_type(v, type2, smush):
+def occurs_in_type(v, type2, subst):
     """Checks whether a type variable occurs in a type expression.
 
     Note: Must be called with v pre-lookuped
@@ -222,29 +241,31 @@ def occurs_in_type(v, type2, smush):
     Args:
         v:  The TypeVariable to be tested for
         type2: The type in which to search
+        subst: The current Substitution
 
     Returns:
         True if v occurs in type2, otherwise False
     """
-    lookuped_type2 = lookup(type2, smush)
+    lookuped_type2 = subst.find(type2)
     if lookuped_type2 == v:
         return True
     elif isinstance(lookuped_type2, TypeOperator):
-        return occurs_in(v, lookuped_type2.types, smush)
+        return occurs_in(v, lookuped_type2.types, subst)
     return False
 
 
-def occurs_in(t, types, smush):
+def occurs_in(t, types, subst):
     """Checks whether a types variable occurs in any other types.
 
     Args:
         t:  The TypeVariable to be tested for
         types: The sequence of types in which to search
+        subst: The current Substitution
 
     Returns:
         True if t occurs in any of types, otherwise False
     """
-    return any(occurs_in_type(t, t2, smush) for t2 in types)
+    return any(occurs_in_type(t, t2, subst) for t2 in types)
 
 
 def curry_lambda(node):
@@ -0,0 +1,115 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+
+Measures how the time taken by type inference (language.type_inference.analyse)
+grows with the size of the program, on a few kinds of deep synthetic
+programs. If inference is linear, the time per node should stay roughly
+constant as the programs get bigger. It also counts the TypeOperators
+allocated during inference and by lookup, and compares re-checking a program
+after replacing one leaf with analyse against the IncrementalChecker. Run
+from the repo root with
+
+    python -m language.type_inference_benchmark
+"""
+import sys
+from timeit import timeit
+
+from language.ast import Identifier, Apply, Lambda, Let, replace_subtree
+from language.incremental import IncrementalChecker
+from language.type_inference import analyse, lookup
+from language.types import TypeOperator
+from language.v1 import type_env
+
+
+def apply_chain(n):
+    """pred (pred (... (pred 1)))"""
+    node = Identifier("1")
+    for _ in range(n):
+        node = Apply(Identifier("pred"), node)
+    return node
+
+
+def plus_tree(depth):
+    """a balanced tree of plus, with 2^depth leaves"""
+    if depth == 0:
+        return Identifier("1")
+    child = plus_tree(depth - 1)
+    return Apply(Apply(Identifier("plus"), child), child)
+
+
+def let_chain(n):
+    """let x0 = 1 in let x1 = pred x0 in ... xn"""
+    body = Identifier(f"x{n}")
+    for i in reversed(range(1, n + 1)):
+        body = Let(f"x{i}", Apply(Identifier("pred"), Identifier(f"x{i - 1}")), body)
+    return Let("x0", Identifier("1"), body)
+
+
+def polymorphic_chain(n):
+    """let f = fn x => x in eq (f (f ... 1)) (f (f ... 1))
+
+    Every use of f gets a fresh copy of its (generic) type
+    """
+    arg = Identifier("1")
+    for _ in range(n // 2):
+        arg = Apply(Identifier("f"), arg)
+    return Let("f", Lambda("x", Identifier("x")),
+               Apply(Apply(Identifier("eq"), arg), arg))
+
+
+def benchmark(name, make, sizes, number=5):
+    print(name)
+    for n in sizes:
+        program = make(n)
+        t = timeit(lambda: analyse(program, type_env), number=number) / number
+        size = program.size
+
+        # count the TypeOperators built by inference, and by looking up the
+        # resolved type of the program twice (the second lookup should hit
+        # the cache in the substitution)
+        TypeOperator.reset_counters()
+        result, subst = analyse(program, type_env)
+        analyse_allocations = TypeOperator.num_allocated
+        TypeOperator.reset_counters()
+        lookup(result, subst)
+        lookup(result, subst)
+        lookup_allocations = TypeOperator.num_allocated
+
+        print(f"\t{size} nodes:\t{t * 1e3:.2f}ms\t{t / size * 1e6:.2f}us/node"
+              f"\t{analyse_allocations / size:.2f} types/node"
+              f"\t{lookup_allocations} types built by lookup")
+
+
+def benchmark_incremental(depths=(6, 8, 10, 12), number=100):
+    """replace the leftmost leaf of a plus tree, and type check the result"""
+    print("replacing one leaf of a plus tree")
+    for depth in depths:
+        program = plus_tree(depth)
+        checker = IncrementalChecker(type_env)
+        checker.check(program)
+
+        # the path to the leftmost leaf: (plus x) is child 0 of (plus x y),
+        # and x is child 1 of (plus x)
+        path = (0, 1) * depth
+        leaves = [Identifier(str(i)) for i in range(number)]
+        mutants = [replace_subtree(program, path, leaf) for leaf in leaves]
+
+        full = timeit(lambda: [analyse(m, type_env) for m in mutants], number=1) / number
+        incremental = timeit(lambda: [checker.check(m) for m in mutants], number=1) / number
+        print(f"\t{program.size} nodes (depth {2 * depth}):"
+              f"\tanalyse {full * 1e3:.2f}ms\tincremental {incremental * 1e3:.2f}ms")
+
+
+if __name__ == '__main__':
+    # the programs are deeper than python's default recursion limit allows
+    sys.setrecursionlimit(100000)
+
+    t, subst = analyse(polymorphic_chain(10), type_env)
+    print(f"{polymorphic_chain(4)} : {lookup(t, subst)}\n")
+
+    benchmark("apply chain", apply_chain, [100, 200, 400, 800, 1600])
+    benchmark("plus tree", plus_tree, [6, 7, 8, 9, 10])
+    benchmark("let chain", let_chain, [100, 200, 400, 800, 1600])
+    benchmark("polymorphic chain", polymorphic_chain, [100, 200, 400, 800, 1600])
+    benchmark_incremental()
@@ -46,11 +46,18 @@ class TypeVariable(object):
 
 
 class TypeOperator(object):
-    """An n-ary type constructor which builds a new type from old"""
+    """An n-ary type constructor which builds a new type from old
+
+    num_allocated counts the TypeOperators created, so that we can measure
+    how many types inference builds.
+    """
+
+    num_allocated = 0
 
     def __init__(self, name, types):
         self.name = name
         self.types = types
+        TypeOperator.num_allocated += 1
 
     def __str__(self):
         num_types = len(self.types)
@@ -67,6 +74,10 @@ class TypeOperator(object):
         else:
             return f"{self.name}({', '.join([str(t) for t in self.types])})"
 
+    @classmethod
+    def reset_counters(cls):
+        cls.num_allocated = 0
+
 
 class Function(TypeOperator):
     """A binary type constructor which builds function types"""
@@ -1,13 +1,24 @@
 import numpy as np
+from language import batch
 from language.types import *
+from grid_arithmetic import grid_add, grid_sub, grid_mul, narrow
 
 type_env = {}
 eval_env = {}
 
-def make(name, func, functype):
-    """adds a command to the type and evaluation environments"""
+def make(name, func, functype, batched=None):
+    """adds a command to the type and evaluation environments
+
+    batched is an optional (arity, function) pair, used by
+    language.eval.eval_batch. function takes all arity (uncurried) arguments
+    at once, any of which may be a language.batch.Batch, and returns the
+    result for every input together, or NotImplemented if it can't handle
+    those arguments.
+    """
     eval_env[name] = func
     type_env[name] = functype
+    if batched is not None:
+        func.arity, func.batched = batched
 
 # create some type variables used to define polymorphic types
 T0 = TypeVariable()
@@ -37,21 +48,31 @@ Integer_array_2 = TypeOperator('array', [Integer_array])
 # so we might want write a tool that curries an AST
 
 
+# NOTE(izzy): grids (and the elements of grids) are uint8, so arithmetic
+# goes through grid_arithmetic's grid_add, grid_sub and grid_mul, which never
+# overflow. Otherwise (pred 0) would be 255. The result is uint8 if all of its
+# values fit, which elementwise decides for each grid of a batch separately.
+_pred = lambda x: grid_sub(x, 1)
+
 make("pred",
-    lambda x: x - 1,
-    Function(Integer, Integer))
+    _pred,
+    Function(Integer, Integer),
+    batched=(1, batch.elementwise(_pred, narrow)))
 
 make("plus",
-    lambda x: lambda y: x + y,
-    curried_type(Integer, Integer, Integer))
+    lambda x: lambda y: grid_add(x, y),
+    curried_type(Integer, Integer, Integer),
+    batched=(2, batch.elementwise(grid_add, narrow)))
 
 make("times",
-    lambda x: lambda y: x * y,
-    curried_type(Integer, Integer, Integer))
+    lambda x: lambda y: grid_mul(x, y),
+    curried_type(Integer, Integer, Integer),
+    batched=(2, batch.elementwise(grid_mul, narrow)))
 
 make("eq",
     lambda x: lambda y: x == y,
-    curried_type(T0, T0, Bool))
+    curried_type(T0, T0, Bool),
+    batched=(2, batch.elementwise(lambda x, y: x == y)))
 
 make("index",
     lambda a: lambda i: a[i],
@@ -59,7 +80,8 @@ make("index",
 
 make("trans",
     lambda a: a.T,
-    Function(T0_array_2, T0_array_2))
+    Function(T0_array_2, T0_array_2),
+    batched=(1, batch.transpose))
 
 # NOTE(izzy): here we run into a minor problem with the current type system,
 # because of the way we're representing 2D arrays as array(array(T)).
@@ -69,8 +91,9 @@ make("trans",
 # for consistency that would have to return an array(int), so it
 # would have dropped a dimension from the input 2D array
 make("zeros_like",
-    lambda a: np.zeros_like(a, dtype=int),
-    Function(T0_array, Integer_array))
+    lambda a: np.zeros_like(a, dtype=np.uint8),
+    Function(T0_array, Integer_array),
+    batched=(1, lambda a: batch.zeros_like(a, dtype=np.uint8)))
 
 make("cond",
     lambda pred: lambda x: lambda y: x if pred else y,
@@ -89,7 +112,7 @@ make("cond",
 
 T_map = Function(T0, T1)
 make("map",
-    lambda f: lambda a: np.array([f(x) for x in a]),
+    lambda f: lambda a: narrow(np.array([f(x) for x in a])),
     curried_type(T_map, T0_array, T1_array))
 
 T_filter = Function(T0, Bool)
@@ -5,9 +5,9 @@ Izzy Brand, 2020
 ## Inspired by Peter Norvig, 2010-16; See http://norvig.com/lispy.html
 
 from __future__ import division
-from copy import deepcopy
 import numpy as np
 import sys
+import time
 from arc_lisp_env import extended_env
 from environment import typed_env
 from old_types.type_check import type_check
@@ -86,7 +86,11 @@ def repl(prompt='lis.py> ', env=global_env):
         print(f'Type check? {pass_type_check}\tType {return_type}')
 
         if pass_type_check:
-            val = eval(x, repl=False, env=env)
+            try:
+                val = eval(x, repl=False, env=env)
+            except Exception as E:
+                print(f'{type(E).__name__}: {E}')
+                continue
             if val is not None:
                 print(lispstr(val))
 
@@ -106,14 +110,108 @@ class Procedure(object):
         self.parms, self.body, self.env = parms, body, env
     def __call__(self, *args):
         new_env = Env(zip(self.parms, args), outer=self.env)
-        return eval(self.body, new_env)
+        budget = current_budget
+        if budget is None:
+            return eval(self.body, new_env)
+        budget.enter()
+        try:
+            return eval(self.body, new_env)
+        except RecursionError:
+            # without a max_depth, runaway recursion ends when Python runs out
+            # of stack, which should look the same as any other exceeded budget
+            raise BudgetExceeded('recursion deeper than Python allows') from None
+        finally:
+            budget.exit()
     def __str__(self):
         return self.func_string
 
+################ Budgets
+
+# NOTE(izzy): randomly mutated programs can recurse forever (a lambda in a
+# define can call itself), build enormous grids, or just take a very long
+# time. A Budget limits how much work an evaluation can do. Evaluation checks
+# the budget as it goes (eval counts steps, a Procedure counts how deeply it
+# is nested, and each primitive's result counts towards the grid cells), and
+# raises BudgetExceeded as soon as any limit is passed, which the caller can
+# catch like any other error. The budget is only checked between steps, so a
+# single primitive which takes a long time can still overrun the deadline.
+#
+#     with Budget(max_steps=10000, seconds=1):
+#         eval(x, env)
+
+class BudgetExceeded(Exception):
+    "Raised when an evaluation runs out of steps, depth, grid cells or time."
+
+# the budget of the evaluation in progress (None for no limits)
+current_budget = None
+
+class Budget(object):
+    """Limits on an evaluation (None means no limit). Use it as a context
+    manager around the evaluation."""
+    def __init__(self, max_steps=None, max_depth=None, max_cells=None, seconds=None):
+        self.max_steps, self.max_depth, self.max_cells = max_steps, max_depth, max_cells
+        self.seconds = seconds
+        self.steps = self.depth = self.cells = 0
+        self.deadline = None
+        self.cancelled = False
+        self.outer = None
+
+    def __enter__(self):
+        global current_budget
+        if self.seconds is not None:
+            self.deadline = time.time() + self.seconds
+        self.outer, current_budget = current_budget, self
+        return self
+
+    def __exit__(self, *exc):
+        global current_budget
+        current_budget = self.outer
+
+    def cancel(self):
+        "stop the evaluation at its next step (for instance from a signal handler)"
+        self.cancelled = True
+
+    def step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(f'more than {self.max_steps} steps')
+        # reading the clock costs more than a step, so only do it every so often
+        if self.steps % 64 == 0 and self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded(f'more than {self.seconds} seconds')
+        if self.cancelled:
+            raise BudgetExceeded('cancelled')
+
+    def enter(self):
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            self.depth -= 1
+            raise BudgetExceeded(f'recursion deeper than {self.max_depth}')
+
+    def exit(self):
+        self.depth -= 1
+
+    def allocate(self, value):
+        if isinstance(value, np.ndarray):
+            self.cells += value.size
+            if self.max_cells is not None and self.cells > self.max_cells:
+                raise BudgetExceeded(f'more than {self.max_cells} grid cells')
+
+    def charge(self, steps, cells):
+        "use up steps and cells all at once (the cost of a cached value)"
+        self.steps += steps
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(f'more than {self.max_steps} steps')
+        self.cells += cells
+        if self.max_cells is not None and self.cells > self.max_cells:
+            raise BudgetExceeded(f'more than {self.max_cells} grid cells')
+        if self.cancelled:
+            raise BudgetExceeded('cancelled')
+
 ################ eval
 
 def eval(x, env=global_env, repl=False):
     "Evaluate an expression in an environment."
+    if current_budget is not None: current_budget.step()
 
     # print('Eval', x)
     # NOTE(izzy): all good
@@ -142,20 +240,12 @@ def eval(x, env=global_env, repl=False):
     # local scope.
     elif x[0] == 'define':         # (define var exp body)
 
-        # NOTE(izzy): this implementation is more efficient, because it doesn't
-        # but doesn't copy the environment, but it doesn't support recursion.
-        # The reason recursion won't work, is because to create the new
-        # environment which we pass to the body, we need to evaluate `exp`, the
-        # variable to be bound in the new environment. In the case where we are
-        # defining a recursive function, exp needs access to itself
-        # (_, var, exp, body) = x
-        # new_env = Env([var], [eval(exp, env, repl = repl)], outer=env)
-        # return eval(body, env=new_env, repl = repl)
-
-        # NOTE(izzy): this implementation does support recursion, but it copies
-        # the environment every time which isn't great
+        # NOTE(izzy): this implementation does support recursion. The new
+        # frame is created empty, and `exp` is evaluated inside it, so a
+        # lambda in `exp` closes over the frame and sees `var` once it has
+        # been filled. (This used to deepcopy the whole environment.)
         (_, var, exp, body) = x
-        new_env = deepcopy(env)
+        new_env = Env({}, outer=env)
         new_env[var] = eval(exp, new_env, repl = repl)
 
         return eval(body, env=new_env, repl = repl)
@@ -171,27 +261,156 @@ def eval(x, env=global_env, repl=False):
         (_, parms, body) = x
         return Procedure(parms, body, env, func_string=str(x))
 
-    # NOTE(izzy): all good, but I added a case to allow array indexing
+    # NOTE(izzy): all good, but I added a case to allow array indexing.
+    # Errors used to dump the environment and sys.exit, which killed the
+    # whole search whenever one candidate program failed. Now they go to
+    # the caller (the repl prints them)
     else:                          # (proc arg...)
-        try:
-            proc = eval(x[0], env, repl = repl)
-            args = [eval(exp, env, repl = repl) for exp in x[1:]]
-            if isinstance(proc, np.ndarray): return np.copy(proc[tuple(args)])
-            elif isinstance(proc, tuple): return proc[args[0]]
-            elif isinstance(proc, (int, str)): return proc
-            else: return proc(*args)
-
-        except Exception as E:
-            print(E, '\n')
-            # for debug purposes, if we get an error recur up the environment
-            # and dump the contents to the terminal before exiting
-            env_counter = 0
-            while env is not None:
-                print('Environment', env_counter, env)
-                env = env.outer
-                env_counter += 1
-
-            sys.exit(1)
+        proc = eval(x[0], env, repl = repl)
+        args = [eval(exp, env, repl = repl) for exp in x[1:]]
+        return apply_proc(proc, args)
+
+
+def apply_proc(proc, args):
+    "Apply the value in the function position of an expression to its arguments."
+    if isinstance(proc, np.ndarray): value = np.copy(proc[tuple(args)])
+    elif isinstance(proc, tuple): return proc[args[0]]
+    elif isinstance(proc, (int, str)): return proc
+    else: value = proc(*args)
+    if current_budget is not None: current_budget.allocate(value)
+    return value
+
+################ eval_cached
+
+# NOTE(izzy): during search we evaluate lots of programs which only differ in
+# one subtree, on the same few input grids. eval_cached remembers the value of
+# every pure subexpression in a language.cache.ExprCache, keyed by (the
+# structure of the subexpression, example_id), so a mutated program only pays
+# for the subexpressions that changed. A subexpression is pure if it doesn't
+# contain a define, lambda or ordain, and doesn't refer to any variable bound
+# by an enclosing define or lambda. Every other name is looked up in the env
+# passed to eval_cached, so it's up to the caller to pass the same env (for
+# instance the global env plus the input grid) whenever it passes the same
+# example_id.
+#
+# Under a Budget, a cache hit has to cost the same as evaluating the subtree,
+# otherwise whether a program stays within its budget would depend on what
+# happens to be in the cache (and so on the order programs were run in, and
+# on how they were split between processes). So each value is cached with
+# the (steps, cells) it took, which are charged to the budget whenever it's
+# used. A value cached without a budget has no cost, so under a budget it's
+# evaluated again. If the budget runs out, everything the evaluation put in
+# the cache is taken out again.
+
+def cache_keys(x):
+    """Find the pure subexpressions of x. Returns a dict from the id of each
+    pure list in x to a hashable key for its structure. The dict is only valid
+    while x is alive (and not modified)."""
+    keys = {}
+    impure = set()  # the same list can appear in more than one place
+    uses_ordain = False
+
+    def visit(x, bound):
+        # returns (key, pure) for x
+        nonlocal uses_ordain
+        if isinstance(x, str):
+            return x, x not in bound
+        elif not isinstance(x, list):
+            try:
+                hash(x)
+            except TypeError:
+                return None, False  # arrays, slices
+            # tag constants with their type, so that 1 and True get different keys
+            return (type(x), x), True
+        elif len(x) == 0:
+            return None, False
+        elif x[0] == 'define':
+            (_, var, exp, body) = x
+            visit(exp, bound | {var})
+            visit(body, bound | {var})
+            return None, False
+        elif x[0] == 'lambda':
+            # the body is evaluated by a Procedure with eval, so there's no
+            # point finding keys in it
+            return None, False
+        elif x[0] == 'ordain':
+            uses_ordain = True
+            return None, False
+
+        children = [visit(exp, bound) for exp in x]
+        if all(pure for _, pure in children):
+            key = tuple(k for k, _ in children)
+            keys[id(x)] = key
+            return key, True
+        impure.add(id(x))
+        return None, False
+
+    visit(x, frozenset())
+    # ordain changes the environment for the rest of the program, which
+    # would invalidate everything, so don't cache programs that use it
+    if uses_ordain:
+        return {}
+    return {i: key for i, key in keys.items() if i not in impure}
+
+
+# marks a cache miss, since None is a value that can be cached
+_missing = object()
+
+def eval_cached(x, env, cache, example_id, keys=None):
+    """Evaluate an expression, looking up its pure subexpressions in cache.
+    keys is the result of cache_keys(x), which can be passed in when the same
+    program is run on several examples."""
+    if keys is None:
+        keys = cache_keys(x)
+
+    budget = current_budget
+    added = []  # the keys put in the cache by this evaluation
+
+    def cached(x, env):
+        key = keys.get(id(x)) if isinstance(x, list) else None
+        if key is None:
+            return evaluate(x, env)
+        value, cost = cache.get_with_cost((key, example_id), _missing)
+        if value is _missing or (budget is not None and cost is None):
+            if budget is None:
+                value = evaluate(x, env)
+            else:
+                steps, cells = budget.steps, budget.cells
+                value = evaluate(x, env)
+                cost = (budget.steps - steps, budget.cells - cells)
+            cache.put((key, example_id), value, cost)
+            added.append((key, example_id))
+        elif budget is not None:
+            budget.charge(*cost)
+        return value
+
+    def evaluate(x, env):
+        if current_budget is not None: current_budget.step()
+        if isinstance(x, str):
+            return env.find(x)[x]
+        elif not isinstance(x, list):
+            return x
+        elif x[0] == 'if':
+            (_, test, conseq, alt) = x
+            return cached(conseq if cached(test, env) else alt, env)
+        elif x[0] == 'define':
+            (_, var, exp, body) = x
+            new_env = Env({}, outer=env)
+            new_env[var] = cached(exp, new_env)
+            return cached(body, new_env)
+        elif x[0] in ('lambda', 'ordain'):
+            return eval(x, env)
+        else:
+            proc = cached(x[0], env)
+            args = [cached(exp, env) for exp in x[1:]]
+            return apply_proc(proc, args)
+
+    try:
+        return cached(x, env)
+    except BudgetExceeded:
+        for key in added:
+            cache.discard(key)
+        raise
 
 
 def eval_file(filename, env=global_env, repl = False, display = False):
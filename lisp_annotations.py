@@ -2,10 +2,9 @@
 
 Izzy Brand, 2020
 """
-import json
-import numpy as np
-from util import match, vis
+from util import ExactMatcher, vis
 from lis import parse, eval
+from task_store import get_task
 
 func1_25d8a9c8 =\
 """
@@ -82,23 +81,15 @@ demo_programs = {
 
 
 def test(task_name, func_string, subset='train'):
-    with open(f'ARC/data/training/{task_name}.json') as f:
-        j = json.load(f)
+    task = get_task(task_name)
 
     prog = parse(func_string)
 
 
-    correct = True
-    for i, t in enumerate(j[subset]):
-        input_grid = np.array(t['input'])
-        prog_with_input = ['define', 'grid', input_grid, prog]
-        pred = eval(prog_with_input)
-        #print(pred)
-        # vis(pred)
-        target = np.array(t['output'])
-        correct &= match(pred, target)
-
-    return correct
+    # stop at the first example the program gets wrong
+    examples = task[subset]
+    return ExactMatcher(examples).check(
+        lambda i: eval(['define', 'grid', examples[i].input, prog]))
 
 
 if __name__ == '__main__':
@@ -2,9 +2,9 @@
 
 Izzy Brand, 2020
 """
-import json
 import numpy as np
-from util import match, vis
+from util import ExactMatcher, vis
+from task_store import get_task
 
 def func1_25d8a9c8(grid):
     # create an empty output grid
@@ -22,7 +22,7 @@ def func1_8d510a79(grid):
     red_indices =  np.array(np.nonzero(grid == 2)).T
     blue_indices =  np.array(np.nonzero(grid == 1)).T
     # copy the output from the input
-    output = grid
+    output = np.copy(grid)
     # set the pixels between the red pixels and the bar to be red
     for i, j in red_indices:
         start_index = min(gray_index, i)
@@ -38,7 +38,7 @@ def func1_8d510a79(grid):
     return output
 
 def func1_253bf280(grid):
-    output = grid
+    output = np.copy(grid)
     blue_indices =  np.array(np.nonzero(grid == 8)).T
     for i1, j1 in blue_indices:
         for i2, j2 in blue_indices:
@@ -202,18 +202,11 @@ demo_programs = {
 }
 
 def test(task_name, func, subset='train'):
-    with open(f'ARC/data/training/{task_name}.json') as f:
-        j = json.load(f)
-
-    correct = True
-    for i, t in enumerate(j[subset]):
-        input_grid = np.array(t['input'])
-        pred = func(input_grid)
-        # vis(pred)
-        target = np.array(t['output'])
-        correct &= match(pred, target)
-
-    return correct
+    task = get_task(task_name)
+
+    # stop at the first example the function gets wrong
+    examples = task[subset]
+    return ExactMatcher(examples).check(lambda i: func(examples[i].input))
 
 
 if __name__ == '__main__':
@@ -2,11 +2,20 @@
 
 Izzy Brand, 2020
 """
+import argparse
+from contextlib import contextmanager
+from functools import partial
 import json
+from multiprocessing import Pool
 import numpy as np
 import os
+import random
+import signal
+import time
+import zlib
 
 from search import search_for_simple_sequential_program
+from task_store import get_store
 
 # the Learning agent capable of training on and evaluating ARC tasks
 class Solver:
@@ -42,21 +51,136 @@ def test(solver, test_data):
     return num_correct > 0
 
 
+class TaskTimeout(Exception):
+    """Raised inside a worker when a task runs past its time budget"""
+
+
+@contextmanager
+def time_limit(seconds):
+    """raise TaskTimeout if the body takes longer than seconds (None = forever)
+
+    NOTE(izzy): this uses SIGALRM, so it only works in the main thread of a
+    process (which is where multiprocessing.Pool runs its tasks).
+    """
+    if seconds is None:
+        yield
+        return
+
+    def handler(signum, frame):
+        raise TaskTimeout()
+
+    old_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def solve_task(task_fname, time_budget=None):
+    """ Train and test a Solver on one task
+
+    The random seed is derived from the task name, so a task gets the same
+    result no matter which worker runs it, or in what order.
+
+    Arguments:
+        task_fname {str} -- The task id
+        time_budget {float} -- Seconds allowed for training and testing
+
+    Returns:
+        Dict -- The task, its status (ok, timeout or error), whether it was
+            correct and how long it took
+    """
+    # search samples from both numpy and the random module, so seed both
+    seed = zlib.crc32(task_fname.encode())
+    np.random.seed(seed)
+    random.seed(seed)
+    task = get_store()[task_fname]
+    result = {'task': task_fname, 'status': 'ok', 'correct': False}
+    start = time.time()
+    try:
+        with time_limit(time_budget):
+            s = Solver()
+            s.train(task['train'])
+            result['correct'] = bool(test(s, task['test']))
+    except TaskTimeout:
+        result['status'] = 'timeout'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = repr(e)
+    result['time'] = time.time() - start
+    return result
+
+
+def load_results(results_fname):
+    """ Read the results of a (possibly interrupted) sweep
+
+    Returns:
+        Dict -- Maps task id to its result
+    """
+    results = {}
+    if os.path.exists(results_fname):
+        with open(results_fname) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # a line cut off when the sweep was killed
+                results[result['task']] = result
+    return results
+
+
+def run_sweep(task_fnames, results_fname, num_workers=None, time_budget=None):
+    """ Solve every task over a pool of worker processes
+
+    Each result is appended to results_fname (one json object per line) as
+    soon as it finishes. Tasks which already have a result in results_fname
+    are skipped, so an interrupted sweep can be resumed by running it again.
+
+    Arguments:
+        task_fnames {List(str)} -- The task ids to solve
+        results_fname {str} -- The file to write results to
+        num_workers {int} -- The number of processes (default: all cores)
+        time_budget {float} -- Seconds allowed per task
+
+    Returns:
+        Dict -- Maps task id to its result, for every task in task_fnames
+    """
+    results = load_results(results_fname)
+    todo = [t for t in task_fnames if t not in results]
+    print(f'{len(task_fnames) - len(todo)} tasks already done, {len(todo)} to go')
+
+    # load the corpus before forking, so the workers share it
+    get_store()
+    with Pool(num_workers) as pool, open(results_fname, 'a+') as f:
+        # if the last sweep was killed mid-write, start on a fresh line
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != '\n':
+                f.write('\n')
+        solve = partial(solve_task, time_budget=time_budget)
+        for i, result in enumerate(pool.imap_unordered(solve, todo)):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            results[result['task']] = result
+            print(f"{i + 1}/{len(todo)}\t{result['task']}\t{result['status']}"
+                  f"\t{result['time']:.1f}s" + ('\tWOOOHOOO' if result['correct'] else ''))
+
+    return {t: results[t] for t in task_fnames}
+
+
 if __name__ == '__main__':
-    score = 0
-
-    task_dir = 'ARC/data/training'
-    task_fnames = os.listdir(task_dir)
-    for task_num, task_fname in enumerate(task_fnames):
-        print(task_num, task_fname)
-        with open(task_dir + '/' + task_fname) as f:
-            task = json.load(f)
-
-        s = Solver()
-        s.train(task['train'])
-        correct = test(s, task['test'])
-        score += correct
-        if correct:
-            print('WOOOHOOO')
-
-    print(f'{score} out of {len(task_fnames)} correct')
+    parser = argparse.ArgumentParser(description='Train and test a Solver on every ARC training task')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--budget', type=float, default=None, help='seconds allowed per task')
+    parser.add_argument('--results', default='results.jsonl', help='file to write (and resume) results')
+    args = parser.parse_args()
+
+    task_fnames = get_store().names('training')
+    results = run_sweep(task_fnames, args.results, args.workers, args.budget)
+
+    score = sum(r['correct'] for r in results.values())
+    timeouts = sum(r['status'] == 'timeout' for r in results.values())
+    errors = sum(r['status'] == 'error' for r in results.values())
+    print(f'{score} out of {len(task_fnames)} correct ({timeouts} timeouts, {errors} errors)')
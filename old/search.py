@@ -5,6 +5,7 @@ Izzy Brand, 2020
 import numpy as np
 from random import choices as sample_with_replacement
 
+from old_search.equivalence import EquivalenceIndex
 from primitives import language
 from programs import SimpleSequentialProgram
 from util import *
@@ -12,16 +13,18 @@ from util import *
 def eval(program, train_data):
     num_correct = 0
     score = 0
+    outputs = []
 
     for t in train_data:
         grid = np.array(t['input'], dtype=int)
         target = np.array(t['output'], dtype=int)
         pred = program(grid)
+        outputs.append(pred)
 
         num_correct += match(pred, target)
         score += heursitic_score(pred, target)
 
-    return num_correct, score
+    return num_correct, score, outputs
 
 def heursitic_score(pred, target):
     score = 0
@@ -74,8 +77,15 @@ def fit_params_simple_sequential_program(program, train_data):
     # a perfect fit
     best_score = 0
     best_params = params
-    for _ in range(100):
-        num_correct, score = eval(program, train_data)
+    for attempt in range(100):
+        # NOTE(izzy): resample before evaluating (rather than after), so that
+        # the program is left compiled with the params the returned outputs
+        # came from
+        if attempt > 0:
+            params = sample_params(types)
+            program.compile(params)
+
+        num_correct, score, outputs = eval(program, train_data)
 
         # if we've found params that work, we're done
         if num_correct == num_training_examples: break
@@ -84,16 +94,15 @@ def fit_params_simple_sequential_program(program, train_data):
             best_score = score
             best_params = params
 
-        params = sample_params(types)
-        program.compile(params)
-
-    return num_correct, score
+    return num_correct, score, outputs
 
 
 def search_for_simple_sequential_program(train_data):
     candidate_programs = []
     correct_programs = []
     num_training_examples = len(train_data)
+    # the shortest program we've found for each distinct set of outputs
+    index = EquivalenceIndex(size=lambda P: len(P.primitives))
 
     for _ in range(100):
         # TODO(izzy): right now I'm just sampling a brand new program
@@ -104,9 +113,18 @@ def search_for_simple_sequential_program(train_data):
         program = sample_simple_sequential_program()
         if program is None: continue
 
-        num_correct, score = \
+        num_correct, score, outputs = \
             fit_params_simple_sequential_program(program, train_data)
 
+        # skip programs that compute the same thing as a program we already
+        # have (unless they're shorter, in which case they replace it). The
+        # outputs are the ones from the last evaluation during fitting
+        accepted, replaced = index.add(program, outputs)
+        if not accepted: continue
+        if replaced is not None:
+            candidate_programs = [c for c in candidate_programs if c[0] is not replaced]
+            correct_programs = [P for P in correct_programs if P is not replaced]
+
         candidate_programs.append((program, score))
 
         if num_correct == num_training_examples:
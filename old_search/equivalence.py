@@ -0,0 +1,95 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2021
+"""
+import hashlib
+import numpy as np
+
+from util import grid_hash
+
+
+# NOTE(izzy): most of the programs we generate during search compute
+# something we have already seen -- (f (f grid)) for an involution f, adding
+# an argument that is ignored, wrapping a program in a function that doesn't
+# change its output. Two programs which produce the same outputs on every
+# train input are indistinguishable as far as scoring is concerned, so we
+# only need to keep one of them (the smallest, since it's the most likely to
+# generalize and the cheapest to mutate). The EquivalenceIndex maps a
+# fingerprint of a program's outputs on the train inputs to the smallest
+# program with those outputs.
+
+
+def fingerprint(outputs, hashes=None):
+    """a hash of the outputs of a program on each of the train inputs
+
+    Grids which are equal get the same fingerprint regardless of dtype (see
+    util.grid_hash), since they score the same. hashes is the grid_hash of
+    each output, if they're already known. An output of None (which is what
+    we record if the program failed on that input) gets its own fingerprint.
+    """
+    if hashes is None:
+        hashes = [grid_hash(out) for out in outputs]
+    h = hashlib.blake2b(digest_size=16)
+    for out, digest in zip(outputs, hashes):
+        if digest is not None:
+            h.update(b'grid')
+            h.update(digest)
+        elif isinstance(out, np.ndarray):
+            h.update(f'array{out.shape}{out.dtype.str}'.encode())
+            h.update(np.ascontiguousarray(out).tobytes())
+        else:
+            h.update(f'{type(out).__name__}:{out!r}'.encode())
+        h.update(b';')
+    return h.digest()
+
+
+class EquivalenceIndex(object):
+    """The smallest known program for each distinct set of train outputs
+
+    Args:
+        size: A function that gives the size of a program
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.representatives = {}
+        self.num_added = 0
+        self.num_duplicates = 0
+        self.num_replaced = 0
+
+    def add(self, program, outputs):
+        """record a program and its outputs on the train inputs
+
+        Returns:
+            (accepted, replaced). accepted is False if an equivalent program
+            which is no larger than program is already known, in which case
+            program should be discarded. Otherwise, replaced is the larger
+            equivalent program that program now represents (or None if
+            program's outputs are new), which should be discarded instead.
+        """
+        return self.add_fingerprint(program, fingerprint(outputs))
+
+    def add_fingerprint(self, program, key):
+        """add, given the fingerprint of program's outputs rather than the
+        outputs themselves"""
+        old = self.representatives.get(key)
+        if old is not None and self.size(old) <= self.size(program):
+            self.num_duplicates += 1
+            return False, None
+
+        self.representatives[key] = program
+        if old is None:
+            self.num_added += 1
+        else:
+            self.num_replaced += 1
+        return True, old
+
+    def __contains__(self, outputs):
+        return fingerprint(outputs) in self.representatives
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def __str__(self):
+        return (f'EquivalenceIndex({len(self)} classes, {self.num_duplicates} '
+                f'duplicates discarded, {self.num_replaced} replaced by smaller programs)')
@@ -5,31 +5,180 @@ Izzy Brand, 2020
 import numpy as np
 
 
-def same_colors(g1, g2):
-    return set(g1.ravel()) == set(g2.ravel())
+# NOTE(izzy): the targets never change during the search for a task, so
+# everything the heuristics need to know about a target is computed once, in
+# a TargetFeatures, rather than every time a prediction is scored. Every
+# heuristic takes the prediction and the TargetFeatures of the target (score
+# and score_batch accept either a grid or its TargetFeatures).
 
-def same_background(g1, g2):
-    return np.median(g1) == np.median(g2)
+def label_components(grid):
+    """the connected components of the foreground of grid: groups of
+    neighboring (up, down, left or right) cells of the same nonzero color
 
-def same_shape(g1, g2):
-    return g1.shape == g2.shape
+    Returns:
+        (labels, count). labels has the shape of grid, with 0 for the
+        background and 1 to count for the cells of each component
+    """
+    labels = np.zeros(grid.shape, dtype=int)
+    if grid.ndim != 2:
+        return labels, 0
+    count = 0
+    for start in zip(*np.nonzero(grid > 0)):
+        if labels[start]: continue
+        count += 1
+        labels[start] = count
+        stack = [start]
+        while stack:
+            i, j = stack.pop()
+            for n in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+                if 0 <= n[0] < grid.shape[0] and 0 <= n[1] < grid.shape[1] and \
+                        not labels[n] and grid[n] == grid[i, j]:
+                    labels[n] = count
+                    stack.append(n)
+    return labels, count
 
-def same_structure(g1, g2):
-    return ((g1 > 0) * (g2 > 0)).all()
 
-def overlap(g1, g2):
-    return (g1 == g2).mean()
+class TargetFeatures(object):
+    """Everything the heuristics compare predictions to, for one target grid
 
+    Args:
+        grid: The target
+    """
 
-def score(g1, g2):
+    def __init__(self, grid):
+        self.grid = grid
+        self.flat = grid.ravel()
+        self.shape = grid.shape
+        self.colors = set(self.flat)
+        self.background = np.median(grid)
+        self.foreground = grid > 0
+        self.all_foreground = self.foreground.all()
+        self._histogram = None
+        self._components = None
+
+    @property
+    def histogram(self):
+        """the number of cells of each color (None if the grid has values
+        other than the colors 0-9), found the first time it's needed"""
+        if self._histogram is None and is_color_grid(self.grid):
+            self._histogram = histograms([self.grid])[0]
+        return self._histogram
+
+    @property
+    def components(self):
+        """(labels, count) from label_components, found the first time
+        they're needed (none of the heuristics in score need them)"""
+        if self._components is None:
+            self._components = label_components(self.grid)
+        return self._components
+
+def features(target):
+    return target if isinstance(target, TargetFeatures) else TargetFeatures(target)
+
+
+def same_colors(g, t):
+    return set(g.ravel()) == t.colors
+
+def same_background(g, t):
+    return np.median(g) == t.background
+
+def same_shape(g, t):
+    return g.shape == t.shape
+
+def same_structure(g, t):
+    return ((g > 0) * t.foreground).all()
+
+def overlap(g, t):
+    return (g == t.grid).mean()
+
+
+def score(g, target):
+    t = features(target)
     score = 0.
 
-    if same_shape(g1, g2):
+    if same_shape(g, t):
         score += 1
-        score += same_structure(g1, g2)
-        score += overlap(g1, g2)
+        score += same_structure(g, t)
+        score += overlap(g, t)
 
-    score += same_colors(g1, g2)
-    score += same_background(g1,g2)
+    score += same_colors(g, t)
+    score += same_background(g, t)
 
     return score
+
+
+# NOTE(izzy): score builds a python set of the colors of every prediction
+# and takes its median, one prediction at a time. score_batch scores a whole
+# list of predictions against the same target with a few numpy operations:
+# the colors and the median of each grid come from a histogram of its
+# colors (one bincount for all of them), and the predictions with the same
+# shape as the target are stacked to compare them to it all at once. The
+# terms are added up in the same order as in score, so the scores are
+# exactly the same.
+
+NUM_COLORS = 10
+
+def histograms(grids):
+    """the number of cells of each color in each grid, as a (len(grids),
+    NUM_COLORS) array. The grids can only contain the colors 0-9"""
+    sizes = [g.size for g in grids]
+    rows = np.repeat(np.arange(len(grids)), sizes)
+    colors = np.concatenate([g.ravel() for g in grids]).astype(np.int64)
+    counts = np.bincount(rows * NUM_COLORS + colors, minlength=len(grids) * NUM_COLORS)
+    return counts.reshape(len(grids), NUM_COLORS)
+
+def histogram_medians(hist):
+    """the median of each grid (like np.median), from its histogram"""
+    n = hist.sum(axis=1)
+    cum = hist.cumsum(axis=1)
+    # the kth smallest cell of each grid is the first color with more than
+    # k cells up to and including it
+    lower = (cum > ((n - 1) // 2)[:, None]).argmax(axis=1)
+    upper = (cum > (n // 2)[:, None]).argmax(axis=1)
+    medians = (lower + upper) / 2
+    medians[n == 0] = np.nan
+    return medians
+
+def is_color_grid(g):
+    return isinstance(g, np.ndarray) and g.dtype.kind in 'biu' and \
+        (g.size == 0 or (g.min() >= 0 and g.max() < NUM_COLORS))
+
+def score_batch(preds, target):
+    """score(pred, target) for each of preds, all at once
+
+    Predictions which aren't grids of the colors 0-9 are scored one at a
+    time with score, and anything which can't be scored gets 0.
+
+    Returns:
+        An array of the scores
+    """
+    t = features(target)
+    scores = np.zeros(len(preds))
+    fast = [i for i, p in enumerate(preds) if is_color_grid(p)]
+    for i, p in enumerate(preds):
+        if not is_color_grid(p):
+            try:
+                scores[i] = score(p, t)
+            except Exception:
+                scores[i] = 0
+    if not fast or t.histogram is None:
+        if fast:
+            scores[fast] = [score(preds[i], t) for i in fast]
+        return scores
+
+    grids = [preds[i] for i in fast]
+    s = np.zeros(len(grids))
+
+    same = [j for j, g in enumerate(grids) if g.shape == t.shape]
+    if same:
+        stack = np.stack([grids[j] for j in same]).reshape(len(same), -1)
+        s[same] += 1
+        s[same] += (stack > 0).all(axis=1) & t.all_foreground
+        s[same] += (stack == t.flat).mean(axis=1)
+
+    hist = histograms(grids)
+    s += ((hist > 0) == (t.histogram > 0)).all(axis=1)
+    s += histogram_medians(hist) == t.background
+
+    scores[fast] = s
+    return scores
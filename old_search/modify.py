@@ -1,4 +1,3 @@
-from copy import deepcopy
 import numpy as np
 
 from lis import global_env
@@ -68,7 +67,10 @@ def modify(prog):
             if new_sub_prog is None:
                 return None # we failed to modify
             else:
-                new_prog = deepcopy(prog)
+                # NOTE(izzy): none of the modifications change a program in
+                # place (they all build new lists), so the new program can
+                # share every subtree except the one we changed
+                new_prog = list(prog)
                 new_prog[i] = new_sub_prog
                 return new_prog
 
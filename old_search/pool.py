@@ -0,0 +1,221 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2020
+"""
+import heapq
+import itertools
+import numpy as np
+
+
+# NOTE(izzy): the programs in the pool never change, so neither do their
+# scores. The ScoredPool stores the score of each program when it's added,
+# and keeps a min-heap and a max-heap of (score, slot) so that the worst
+# program (the one to replace) and the best program (the high score) can be
+# found without looking at the rest of the pool.
+#
+# When a slot is replaced its old heap entries aren't removed (that would be
+# O(n)); they're just left behind and skipped when they reach the top of a
+# heap, since their score no longer matches the score in the slot. The heaps
+# are rebuilt when they get too big.
+
+
+class ScoredPool(object):
+    """A fixed-size pool of programs, each with its score
+
+    Args:
+        max_size: The most programs the pool can hold
+    """
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.programs = []
+        self.scores = []
+        # the version of each slot, which is incremented when it's replaced
+        self.versions = []
+        # how many times the program in each slot has been expanded (had a
+        # mutation of it tried), and the total reward of those expansions
+        self.expansions = []
+        self.rewards = []
+        self.total_expansions = 0
+        # the slot of each program, by id
+        self.slots = {}
+        self.min_heap = []
+        self.max_heap = []
+        # break ties between equal scores in the order they were added
+        self.counter = itertools.count()
+
+    def add(self, program, score):
+        """add program to the pool (which must not be full). Returns its slot"""
+        assert not self.is_full(), 'the pool is full'
+        slot = len(self.programs)
+        self.programs.append(program)
+        self.scores.append(score)
+        self.versions.append(0)
+        self.expansions.append(0)
+        self.rewards.append(0.)
+        self.slots[id(program)] = slot
+        self.push(slot)
+        return slot
+
+    def replace(self, slot, program, score):
+        """put program in slot, in place of the program that was there"""
+        del self.slots[id(self.programs[slot])]
+        self.programs[slot] = program
+        self.slots[id(program)] = slot
+        self.scores[slot] = score
+        self.versions[slot] += 1
+        self.expansions[slot] = 0
+        self.rewards[slot] = 0.
+        self.push(slot)
+
+    def record(self, slot, reward):
+        """record that the program in slot was expanded, with a reward
+        between 0 and 1 for how good the new program was"""
+        self.expansions[slot] += 1
+        self.rewards[slot] += reward
+        self.total_expansions += 1
+
+    def push(self, slot):
+        score, version = self.scores[slot], self.versions[slot]
+        count = next(self.counter)
+        heapq.heappush(self.min_heap, (score, count, slot, version))
+        heapq.heappush(self.max_heap, (-score, count, slot, version))
+        if len(self.min_heap) > 4 * len(self.programs) + 16:
+            self.rebuild()
+
+    def rebuild(self):
+        """drop the stale entries from the heaps"""
+        self.min_heap = [(s, next(self.counter), i, v) for i, (s, v)
+                         in enumerate(zip(self.scores, self.versions))]
+        self.max_heap = [(-s, c, i, v) for s, c, i, v in self.min_heap]
+        heapq.heapify(self.min_heap)
+        heapq.heapify(self.max_heap)
+
+    def top(self, heap):
+        """the slot at the top of heap, after popping any stale entries"""
+        while heap:
+            _, _, slot, version = heap[0]
+            if version == self.versions[slot]:
+                return slot
+            heapq.heappop(heap)
+        raise IndexError('the pool is empty')
+
+    def worst(self):
+        """the slot of the lowest scoring program"""
+        return self.top(self.min_heap)
+
+    def best(self):
+        """the slot of the highest scoring program"""
+        return self.top(self.max_heap)
+
+    def best_score(self):
+        return self.scores[self.best()]
+
+    def sample(self):
+        """the slot of a random program"""
+        return np.random.randint(len(self.programs))
+
+    def slot_of(self, program):
+        """the slot program is in (compared by identity), or None"""
+        return self.slots.get(id(program))
+
+    def is_full(self):
+        return len(self.programs) >= self.max_size
+
+    def __len__(self):
+        return len(self.programs)
+
+    def __getitem__(self, slot):
+        return self.programs[slot]
+
+    def __iter__(self):
+        return iter(self.programs)
+
+    def __str__(self):
+        if not self.programs:
+            return 'ScoredPool(empty)'
+        return f'ScoredPool({len(self)} programs, best {self.best_score()}, ' \
+               f'worst {self.scores[self.worst()]})'
+
+
+# NOTE(izzy): most mutations of a program are worse than it, and some
+# programs are dead ends: nothing we do to them helps. Rather than picking
+# which program to expand uniformly, we can treat each program in the pool as
+# the arm of a bandit, where the reward for expanding it is how good the new
+# program is compared to it (see old_search.run.expansion_reward).
+#
+# The usual bandit policies try every arm before trying any arm twice. But
+# every expansion can add a new program to the pool, so that would mean
+# always expanding the newest program, which turns the search into a random
+# walk. Instead, the estimated reward of each program starts at the mean
+# reward of every expansion so far, and moves towards its own mean reward as
+# it's expanded (prior_strength is how many expansions that takes).
+
+
+def pooled_rates(pool, prior_strength):
+    """the estimated reward of expanding each program, and the number of
+    (pseudo-)expansions each estimate is based on"""
+    n = np.array(pool.expansions, dtype=float)
+    rewards = np.array(pool.rewards)
+    mean = (rewards.sum() + 0.5) / (n.sum() + 1)
+    n = n + prior_strength
+    return (rewards + mean * prior_strength) / n, n
+
+
+class UniformPolicy(object):
+    """pick a program to expand uniformly at random"""
+
+    def select(self, pool):
+        return pool.sample()
+
+    def __str__(self):
+        return 'uniform'
+
+
+class UCBPolicy(object):
+    """pick the program with the highest upper confidence bound (UCB1) on
+    the reward of expanding it
+
+    Args:
+        c: How much to favor programs which haven't been expanded much
+        prior_strength: The number of expansions the pooled prior is worth
+    """
+
+    def __init__(self, c=np.sqrt(2), prior_strength=2):
+        self.c = c
+        self.prior_strength = prior_strength
+
+    def select(self, pool):
+        rate, n = pooled_rates(pool, self.prior_strength)
+        bound = rate + self.c * np.sqrt(np.log(pool.total_expansions + 1) / n)
+        return np.random.choice(np.where(bound == bound.max())[0])
+
+    def __str__(self):
+        return f'ucb(c={self.c:.2f})'
+
+
+class ThompsonPolicy(object):
+    """pick a program by sampling the reward of expanding it from a Beta
+    posterior, and taking the highest sample
+
+    Args:
+        prior_strength: The number of expansions the pooled prior is worth
+    """
+
+    def __init__(self, prior_strength=2):
+        self.prior_strength = prior_strength
+
+    def select(self, pool):
+        rate, n = pooled_rates(pool, self.prior_strength)
+        samples = np.random.beta(rate * n + 1e-3, (1 - rate) * n + 1e-3)
+        return np.argmax(samples)
+
+    def __str__(self):
+        return 'thompson'
+
+
+policies = {
+    'uniform': UniformPolicy,
+    'ucb': UCBPolicy,
+    'thompson': ThompsonPolicy,
+}
@@ -2,76 +2,401 @@
 
 Izzy Brand, 2020
 """
+import argparse
 import numpy as np
-import os
-import json
+import time
+from multiprocessing import Pool
 
-from lis import eval, lispstr, global_env
-from lisp_annotations import test as lisp_test
-from search.heuristics import score as heuristic_score
-from search.modify import modify
-from util import match, vis
+from language.cache import ExprCache
+from lis import Budget, Env, cache_keys, eval_cached, lispstr, global_env
+from old_search.equivalence import EquivalenceIndex, fingerprint
+from old_search.heuristics import TargetFeatures, score as heuristic_score, score_batch
+from old_search.modify import modify, prog_len
+from old_search.pool import ScoredPool, UniformPolicy, policies
+from task_store import get_store, get_task
+from util import ExactMatcher, TargetIndex, grid_hash, match
 
-def run_program_on_task(task_fname, prog, subset='train', score_func=match):
-    with open(f'ARC/data/training/{task_fname}') as f:
-        j = json.load(f)
+# the values of subexpressions, shared between every program we try. Most
+# candidates are small modifications of programs in the pool, so most of
+# their subexpressions have already been evaluated on the same grids
+expr_cache = ExprCache()
 
-    scores = []
-    for i, t in enumerate(j[subset]):
-        input_grid = np.array(t['input'])
-        prog_with_input = ['define', 'grid', input_grid, prog]
+# the most work a candidate program can do on one input (see lis.Budget).
+# Mutated programs can recurse forever or build huge grids, and one of them
+# shouldn't be able to stall the whole search
+eval_limits = dict(max_steps=10000, max_depth=50, max_cells=10**6, seconds=1.)
+
+# the tasks each worker process was given when it started (see init_worker)
+worker_tasks = {}
+
+def load_task(task_fname):
+    if task_fname in worker_tasks:
+        return worker_tasks[task_fname]
+    return get_task(task_fname)
+
+# the TargetFeatures of the outputs of each task, made the first time the
+# task is scored (in each process)
+task_features = {}
+
+def load_target_features(task_fname, subset='train'):
+    if (task_fname, subset) not in task_features:
+        task_features[task_fname, subset] = \
+            [TargetFeatures(t.output) for t in load_task(task_fname)[subset]]
+    return task_features[task_fname, subset]
+
+# the TargetIndex of the outputs of each task, to check whether a program's
+# outputs are exactly right by hash
+target_indexes = {}
+
+def load_target_index(task_fname, subset='train'):
+    if (task_fname, subset) not in target_indexes:
+        target_indexes[task_fname, subset] = \
+            TargetIndex([t.output for t in load_task(task_fname)[subset]])
+    return target_indexes[task_fname, subset]
+
+def run_program_on_example(task_fname, prog, subset, i, keys=None):
+    """the output of prog on input i of subset. keys is cache_keys(prog)"""
+    t = load_task(task_fname)[subset][i]
+    # NOTE(izzy): a program can write into its input (for instance
+    # (logical_and 1 8 grid) passes grid as the out argument), which
+    # would change the task for every program after it
+    grid = t.input.view()
+    grid.setflags(write=False)
+    env = Env({'grid': grid}, outer=global_env)
+    with Budget(**eval_limits):
+        return eval_cached(prog, env, expr_cache, (task_fname, subset, i), keys)
+
+def run_program_outputs(task_fname, prog, subset='train'):
+    """the output of prog on each input in subset (None where it fails)"""
+    task = load_task(task_fname)
+
+    keys = cache_keys(prog)
+    outputs = []
+    for i in range(len(task[subset])):
         try:
-            pred = eval(prog_with_input)
-            target = np.array(t['output'])
-            scores.append(score_func(pred, target))
+            outputs.append(run_program_on_example(task_fname, prog, subset, i, keys))
         except Exception as e:
             # print(f'lisp_score: failed to evaluate program on {task_fname}', e)
             # print(lispstr(prog))
+            outputs.append(None)
+    return outputs
+
+def score_outputs(task_fname, outputs, subset='train', score_func=match, targets=None):
+    """the mean of score_func(output, target) over the examples in subset.
+    The targets are the outputs of the examples, unless they're given"""
+    if targets is None:
+        targets = [t.output for t in load_task(task_fname)[subset]]
+
+    scores = []
+    for pred, target in zip(outputs, targets):
+        try:
+            scores.append(score_func(pred, target))
+        except Exception as e:
             scores.append(0)
 
     return np.mean(scores)
 
-def prog_len(prog):
-    if isinstance(prog, List):
-        return np.sum([prog_len(p) for p in prog])
-    else:
-        return 1
+def run_program_on_task(task_fname, prog, subset='train', score_func=match):
+    outputs = run_program_outputs(task_fname, prog, subset)
+    return score_outputs(task_fname, outputs, subset, score_func)
+
+# the ExactMatcher of each (task, subset), which remembers which examples
+# reject the most programs
+matchers = {}
+
+def solves_task(task_fname, prog, subset='train'):
+    """whether prog gets every example in subset exactly right. Stops
+    running prog as soon as it gets one wrong"""
+    if (task_fname, subset) not in matchers:
+        matchers[task_fname, subset] = ExactMatcher(load_task(task_fname)[subset])
+    keys = cache_keys(prog)
+    return matchers[task_fname, subset].check(
+        lambda i: run_program_on_example(task_fname, prog, subset, i, keys))
+
+
+def evaluate(task_fname, prog, score_func):
+    """run prog on the train pairs. Returns (key, score, solved), where key
+    is the fingerprint of the outputs (see old_search.equivalence)
+
+    Only the fingerprint is returned, since the outputs can be anything
+    (including functions, which can't be sent back from a worker)
+    """
+    outputs = run_program_outputs(task_fname, prog)
+    score = score_outputs(task_fname, outputs, score_func=score_func,
+                          targets=load_target_features(task_fname))
+    return summarize(task_fname, outputs, score)
+
+def summarize(task_fname, outputs, score):
+    """(key, score, solved) for the outputs of a program, given its score"""
+    if np.isnan(score): score = 0. # the heuristics are nan on empty grids
+    # hash each output once, for both the fingerprint and checking whether
+    # it's exactly right
+    hashes = [grid_hash(out) for out in outputs]
+    index = load_target_index(task_fname)
+    solved = all(h is not None and i in index.equal_to(out, h)
+                 for i, (out, h) in enumerate(zip(outputs, hashes)))
+    return fingerprint(outputs, hashes), score, solved
+
+def evaluate_batch(task_fname, progs, score_func, batch_score_func=None):
+    """evaluate on each of progs, scoring the outputs of all of them on each
+    train pair at once with batch_score_func(preds, target) (if it's given,
+    it must agree with score_func)"""
+    if batch_score_func is None:
+        return [evaluate(task_fname, prog, score_func) for prog in progs]
+
+    all_outputs = [run_program_outputs(task_fname, prog) for prog in progs]
+    scores = np.stack([batch_score_func([outputs[i] for outputs in all_outputs], t)
+                       for i, t in enumerate(load_target_features(task_fname))], axis=1)
+    return [summarize(task_fname, outputs, np.mean(example_scores))
+            for outputs, example_scores in zip(all_outputs, scores)]
+
+
+# NOTE(izzy): programs are nested lists of the values in global_env (the
+# primitives themselves, not their names), and some of those are lambdas,
+# which can't be pickled. So before a program is sent to a worker, every
+# primitive is replaced by its name, which evaluates to the same thing.
+primitive_names = {id(v): k for k, v in global_env.items()}
+
+def to_names(prog):
+    if isinstance(prog, list):
+        return [to_names(p) for p in prog]
+    elif not isinstance(prog, (str, int)) and id(prog) in primitive_names:
+        return primitive_names[id(prog)]
+    return prog
+
+def init_worker(task_fname, task):
+    """runs in each worker when it starts, so the task is only sent once"""
+    worker_tasks[task_fname] = task
+
+def evaluate_job(job):
+    task_fname, prog, score_func, seed = job
+    np.random.seed(np.random.SeedSequence(seed).generate_state(1))
+    return evaluate(task_fname, prog, score_func)
 
-def modify_pool(task_fname, pool, max_pool_size=100):
-    prog = np.random.choice(pool)
-    new_prog = modify(prog)
-    if new_prog is None: return # in this case we haven't made any changes
-    new_score = run_program_on_task(task_fname, prog, score_func=heuristic_score)
+def make_workers(task_fname, num_workers=None):
+    """a multiprocessing.Pool which can run programs on task_fname"""
+    return Pool(num_workers, initializer=init_worker,
+                initargs=(task_fname, get_task(task_fname)))
+
+
+class Scorer(object):
+    """Runs programs on the train pairs of a task, and remembers the results
+
+    Every program is only run once: the heuristic score, and whether it
+    solves every train pair, are cached by the program's lisp string.
+    """
+
+    def __init__(self, task_fname, score_func=heuristic_score, batch_score_func=score_batch):
+        self.task_fname = task_fname
+        self.score_func = score_func
+        # scores a list of outputs against one target at once (see
+        # old_search.heuristics.score_batch). It must agree with score_func.
+        # Both are given the TargetFeatures of the targets
+        self.batch_score_func = batch_score_func
+        self.results = {}
+        self.num_evaluated = 0
+
+    def run(self, prog):
+        """returns (key, score, solved) (see evaluate). key is None if prog
+        has already been run"""
+        key = lispstr(prog)
+        if key in self.results:
+            return (None,) + self.results[key]
+
+        fp, score, solved = evaluate(self.task_fname, prog, self.score_func)
+        self.results[key] = (score, solved)
+        self.num_evaluated += 1
+        return fp, score, solved
+
+    def run_batch(self, progs, workers=None, seed=0):
+        """Scorer.run on each of progs. The new programs are run on workers
+        (a multiprocessing.Pool made by make_workers) if it's given, and
+        otherwise in this process, with their outputs scored all at once
+
+        The nth program this Scorer runs is seeded with (seed, n), so the
+        results don't depend on the number of workers
+        """
+        keys = [lispstr(prog) for prog in progs]
+        new = {}
+        for prog, key in zip(progs, keys):
+            if key not in self.results and key not in new:
+                new[key] = prog
+        if workers is None:
+            new_results = dict(zip(new, evaluate_batch(
+                self.task_fname, list(new.values()), self.score_func, self.batch_score_func)))
+        else:
+            jobs = [(self.task_fname, to_names(prog), self.score_func, (seed, self.num_evaluated + i))
+                    for i, prog in enumerate(new.values())]
+            new_results = dict(zip(new, workers.imap(evaluate_job, jobs, chunksize=4)))
+        self.num_evaluated += len(new)
+
+        results = []
+        for key in keys:
+            if key in new_results:
+                fp, score, solved = new_results.pop(key)
+                self.results[key] = (score, solved)
+                results.append((fp, score, solved))
+            else:
+                results.append((None,) + self.results[key])
+        return results
+
+    def score(self, prog):
+        return self.run(prog)[1]
+
+
+def expansion_reward(parent_score, new_score, new):
+    """the reward (for the selection policy) of expanding a program with
+    parent_score into a new program with new_score. Trying a program we've
+    already seen (new is False) is worth nothing"""
+    return float(new and new_score > parent_score)
+
+def modify_pool(pool, scorer, index, policy=UniformPolicy()):
+    """mutate a program in the pool (chosen by policy), and add the result
+    if it's good
+
+    pool is a ScoredPool, which is updated in place. Returns the new program
+    if it solves every train pair, otherwise None
+    """
+    parent = policy.select(pool)
+    new_prog = modify(pool[parent])
+    if new_prog is None: # in this case we haven't made any changes
+        pool.record(parent, 0)
+        return
+    fp, new_score, solved = scorer.run(new_prog)
+    pool.record(parent, expansion_reward(pool.scores[parent], new_score, fp is not None))
+    if fp is None: return # we've already tried this program
+    if solved: return new_prog
+
+    # if the new program computes the same thing as a program we've already
+    # seen (and isn't smaller), there's no point keeping it. If it is
+    # smaller, it takes the place of the old program
+    accepted, replaced = index.add_fingerprint(new_prog, fp)
+    if not accepted: return
+    slot = pool.slot_of(replaced)
+    if slot is not None:
+        pool.replace(slot, new_prog, new_score)
+        return
 
     # if we haven't reached the max pool size, add the program
-    if len(pool) < max_pool_size:
-        pool.append(new_prog)
-    # if we have reached the max pool size, replace a program that the new
-    # program outperforms. pick which program to replace randomly
+    if not pool.is_full():
+        pool.add(new_prog, new_score)
+    # if we have reached the max pool size, replace the worst program in the
+    # pool if the new program is at least as good
+    else:
+        worst = pool.worst()
+        if new_score >= pool.scores[worst]:
+            pool.replace(worst, new_prog, new_score)
+
+def pool_search(task_fname, iterations=10000, max_pool_size=100, print_every=100,
+                policy=UniformPolicy()):
+    """the original search: keep a pool of programs, and repeatedly replace
+    one with a mutation of a program in the pool (see old_search.pool for
+    the policies that choose which program to mutate)"""
+    scorer = Scorer(task_fname)
+    index = EquivalenceIndex(size=prog_len)
+    fp, score, solved = scorer.run('grid')
+    if solved: return 'grid'
+    index.add_fingerprint('grid', fp)
+    pool = ScoredPool(max_pool_size)
+    pool.add('grid', score)
+    high_score = score
+
+    start = time.time()
+    for i in range(iterations):
+        solution = modify_pool(pool, scorer, index, policy)
+        if solution is not None:
+            return solution
+
+        # print if we've increased the high score
+        if pool.best_score() > high_score:
+            high_score = pool.best_score()
+            print(f'New high score! {high_score}')
+            print(lispstr(pool[pool.best()]))
+
+        if (i + 1) % print_every == 0:
+            rate = (i + 1) / (time.time() - start)
+            print(f'Iteration {i + 1}\thigh score: {high_score}\t{rate:.1f} it/s\t'
+                  f'{scorer.num_evaluated} programs run\t{pool}\t{index}')
+
+    return pool[pool.best()]
+
+def beam_search(task_fname, beam_width=10, expansions=10, steps=1000, workers=None, seed=0):
+    """keep the beam_width best programs. At each step, mutate each of them
+    expansions times, and keep the best beam_width of the old and new programs
+
+    Only the new programs are run (the scores of the beam are remembered),
+    so each step costs O(beam_width * expansions) evaluations. Stops as soon
+    as a program solves every train pair.
+
+    If workers (see make_workers) is given, the new programs of each step
+    are run in parallel. The mutations are still made in this process, so
+    the search is the same for any number of workers (given the same seed).
+    """
+    np.random.seed(seed)
+    scorer = Scorer(task_fname)
+    index = EquivalenceIndex(size=prog_len)
+    fp, score, solved = scorer.run('grid')
+    if solved: return 'grid'
+    index.add_fingerprint('grid', fp)
+    beam = [(score, 'grid')]
+
+    for step in range(steps):
+        batch = [modify(prog) for _, prog in beam for _ in range(expansions)]
+        batch = [prog for prog in batch if prog is not None]
+        results = scorer.run_batch(batch, workers, seed)
+
+        candidates = list(beam)
+        for new_prog, (fp, new_score, solved) in zip(batch, results):
+            if fp is None: continue # we've already tried this program
+            if solved: return new_prog
+            accepted, replaced = index.add_fingerprint(new_prog, fp)
+            if not accepted: continue
+            if replaced is not None:
+                candidates = [(s, p) for s, p in candidates if p is not replaced]
+            candidates.append((new_score, new_prog))
+
+        # prefer higher scores, and then smaller programs
+        candidates.sort(key=lambda c: (-c[0], prog_len(c[1])))
+        beam = candidates[:beam_width]
+        print(f'Step {step}\tbest score: {beam[0][0]}\t{scorer.num_evaluated} programs run\t{index}')
+
+    return beam[0][1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search for a lisp program that solves an ARC task')
+    parser.add_argument('--task', default=None, help='task id (default: a random training task)')
+    parser.add_argument('--mode', choices=['pool', 'beam'], default='pool')
+    parser.add_argument('--iterations', type=int, default=10000, help='pool mode: number of mutations')
+    parser.add_argument('--pool-size', type=int, default=100, help='pool mode: max programs in the pool')
+    parser.add_argument('--policy', choices=list(policies), default='uniform',
+                        help='pool mode: how to choose which program to mutate')
+    parser.add_argument('--beam-width', type=int, default=10, help='beam mode: programs kept each step')
+    parser.add_argument('--expansions', type=int, default=10, help='beam mode: mutations of each program per step')
+    parser.add_argument('--steps', type=int, default=1000, help='beam mode: number of steps')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='beam mode: number of processes to run programs on (default: run them in this one)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    task_fname = args.task or np.random.choice(get_store().names('training'))
+    print(f'Working on task: {task_fname}')
+    if args.mode == 'pool':
+        np.random.seed(args.seed)
+        prog = pool_search(task_fname, args.iterations, args.pool_size,
+                           policy=policies[args.policy]())
+    elif args.workers > 0:
+        with make_workers(task_fname, args.workers) as workers:
+            prog = beam_search(task_fname, args.beam_width, args.expansions, args.steps,
+                               workers, args.seed)
     else:
-        scores = np.array([run_program_on_task(task_fname, prog, score_func=heuristic_score)\
-            for prog in pool])
-        new_prog_is_better = new_score >= scores
-        if new_prog_is_better.any():
-            idx = np.random.choice(np.where(new_prog_is_better)[0])
-            pool[idx] = new_prog
-
-task_fname = np.random.choice(os.listdir('ARC/data/training'))
-print(f'Working on task: {task_fname}')
-# with open(f'ARC/data/training/{task_fname}') as f:
-#     j = json.load(f)
-#     vis(np.array(j['train'][0]['input']), block=False)
-pool = ['grid']
-high_score = 0
-for i in range(10000):
-    print(f'Iteration {i}\thigh score: {high_score}')
-    modify_pool(task_fname, pool)
-
-    # print if we've increased the high score
-    scores = np.array([run_program_on_task(task_fname, prog, score_func=heuristic_score)\
-        for prog in pool])
-    best_score_idx = np.argmax(scores)
-    if scores[best_score_idx] > high_score:
-        high_score = scores[best_score_idx]
-        print(f'New high score! {high_score}')
-        print(lispstr(pool[best_score_idx]))
\ No newline at end of file
+        prog = beam_search(task_fname, args.beam_width, args.expansions, args.steps,
+                           seed=args.seed)
+
+    solved = solves_task(task_fname, prog)
+    print(f'{"Solved" if solved else "Best program"}: {lispstr(prog)}')
+    if solved:
+        if any(t.output is None for t in load_task(task_fname).test):
+            print('Test: the task has no test outputs to check against')
+        else:
+            print(f'Test: {"correct" if solves_task(task_fname, prog, "test") else "wrong"}')
@@ -1,4 +1,4 @@
-from type_system import *
+from old_types.type_system import *
 
 def type_check(x, env, print_type_error=True):
     """ Type check the program in the environment, and compute the return type.
@@ -2,8 +2,8 @@ import numpy as np
 
 from environment import typed_env
 from lis import Env, parse
-from type_check import type_check
-from type_system import Type
+from old_types.type_check import type_check
+from old_types.type_system import Type
 
 
 test_programs = []
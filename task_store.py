@@ -0,0 +1,252 @@
+""" Massachusetts Institute of Technology
+
+Izzy Brand, 2020
+"""
+from collections import namedtuple
+import json
+import numpy as np
+import os
+
+# NOTE(izzy): every grid is stored as a read-only uint8 array. ARC colors are
+# 0-9, so uint8 takes an eighth of the memory of numpy's default int64, and
+# making the arrays read-only means a program can't modify a grid in the
+# store by accident (which would change the task for every later program).
+# If you need to modify a grid, copy it first.
+
+class Example(namedtuple('Example', ['input', 'output'])):
+    """An input/output pair. example['input'] also works, like on the json"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super(Example, self).__getitem__(key)
+
+
+def to_grid(x):
+    """convert a nested list from an ARC json file into a read-only grid"""
+    grid = np.array(x, dtype=np.uint8)
+    grid.setflags(write=False)
+    return grid
+
+
+def task_id(task_name):
+    """task names are used with and without the .json extension"""
+    return task_name[:-len('.json')] if task_name.endswith('.json') else task_name
+
+
+class Task(object):
+    """An ARC task
+
+    Args:
+        name: The task id (the filename without .json)
+        subset: The directory the task came from (training or evaluation)
+        train: A list of Examples
+        test: A list of Examples. output is None if the task doesn't include
+            the test outputs
+    """
+
+    def __init__(self, name, subset, train, test):
+        self.name = name
+        self.subset = subset
+        self.train = train
+        self.test = test
+
+    @classmethod
+    def from_json(cls, name, subset, j):
+        def examples(pairs):
+            return [Example(to_grid(t['input']),
+                            to_grid(t['output']) if 'output' in t else None)
+                    for t in pairs]
+        return cls(name, subset, examples(j['train']), examples(j['test']))
+
+    def __getitem__(self, subset):
+        """so that task['train'] works like it does on the json"""
+        if subset == 'train':
+            return self.train
+        elif subset == 'test':
+            return self.test
+        else:
+            raise KeyError(subset)
+
+    def __str__(self):
+        return f'{self.subset}/{self.name}'
+
+
+class TaskStore(object):
+    """All of the ARC tasks, loaded once and kept in memory
+
+    Args:
+        data_dir: The ARC data directory
+        subsets: The subdirectories of data_dir to load
+    """
+
+    def __init__(self, data_dir='ARC/data', subsets=('training', 'evaluation')):
+        self.data_dir = data_dir
+        self.subsets = subsets
+        self.tasks = {}
+        for subset in subsets:
+            subset_dir = os.path.join(data_dir, subset)
+            if not os.path.isdir(subset_dir):
+                continue
+            for fname in sorted(os.listdir(subset_dir)):
+                if not fname.endswith('.json'):
+                    continue
+                with open(os.path.join(subset_dir, fname)) as f:
+                    j = json.load(f)
+                name = task_id(fname)
+                self.tasks[name] = Task.from_json(name, subset, j)
+
+    def __getitem__(self, task_name):
+        return self.tasks[task_id(task_name)]
+
+    def __contains__(self, task_name):
+        return task_id(task_name) in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def names(self, subset=None):
+        """the ids of all of the tasks (in subset, if given)"""
+        return [name for name, task in self.tasks.items()
+                if subset is None or task.subset == subset]
+
+
+# NOTE(izzy): parsing 800 json files full of nested lists and converting them
+# with np.array is slow, and every worker process has to do it again. pack
+# writes every grid in a store into one flat uint8 file (PATH.bin) along with
+# an index (PATH.json) of the offset and shape of each grid. PackedTaskStore
+# memory-maps the .bin file and hands out read-only views into it, so loading
+# is just reading the index, and worker processes share the same pages of
+# memory instead of each having a copy of the corpus. Run
+#
+#     python task_store.py
+#
+# to (re)build the packed corpus. It isn't rebuilt automatically when the
+# json files change, but the index records the name and modification time of
+# every json file it was built from, and get_store ignores a packed corpus
+# (with a warning) if they don't match the json files on disk, for instance
+# because it was left behind by another checkout.
+PACKED_PATH = 'arc_corpus'
+
+
+def source_files(data_dir='ARC/data', subsets=('training', 'evaluation')):
+    """the [subset/fname, mtime] of every task json file, in order"""
+    sources = []
+    for subset in subsets:
+        subset_dir = os.path.join(data_dir, subset)
+        if not os.path.isdir(subset_dir):
+            continue
+        for fname in sorted(os.listdir(subset_dir)):
+            if fname.endswith('.json'):
+                mtime = os.path.getmtime(os.path.join(subset_dir, fname))
+                sources.append([f'{subset}/{fname}', mtime])
+    return sources
+
+
+def pack(store, path=PACKED_PATH):
+    """write every grid in store to path.bin, with an index in path.json"""
+    tasks = {}
+    offset = 0
+    with open(path + '.bin', 'wb') as f:
+        def write(grid):
+            nonlocal offset
+            if grid is None:
+                return None
+            entry = [offset, grid.shape[0], grid.shape[1]]
+            f.write(np.ascontiguousarray(grid, dtype=np.uint8).tobytes())
+            offset += grid.size
+            return entry
+
+        for name, task in store.tasks.items():
+            tasks[name] = {
+                'subset': task.subset,
+                'train': [[write(t.input), write(t.output)] for t in task.train],
+                'test': [[write(t.input), write(t.output)] for t in task.test]
+            }
+
+    index = {
+        'data_dir': store.data_dir,
+        'subsets': list(store.subsets),
+        'sources': source_files(store.data_dir, store.subsets),
+        'tasks': tasks
+    }
+    with open(path + '.json', 'w') as f:
+        json.dump(index, f)
+
+
+def is_current(path=PACKED_PATH):
+    """whether the packed corpus at path was built from the json files that
+    are on disk now"""
+    try:
+        with open(path + '.json') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(index, dict) or 'sources' not in index:
+        return False  # written before the sources were recorded
+    return index['sources'] == source_files(index['data_dir'], index['subsets'])
+
+
+class PackedTaskStore(TaskStore):
+    """A TaskStore backed by a corpus written by pack
+
+    The grids are read-only views into a memory-mapped file, so nothing is
+    copied until a grid is actually read.
+
+    Args:
+        path: The path passed to pack (without an extension)
+    """
+
+    def __init__(self, path=PACKED_PATH):
+        with open(path + '.json') as f:
+            index = json.load(f)
+        self.data_dir = index['data_dir']
+        self.subsets = tuple(index['subsets'])
+
+        self.buffer = np.memmap(path + '.bin', dtype=np.uint8, mode='r') \
+            if os.path.getsize(path + '.bin') > 0 else np.zeros(0, dtype=np.uint8)
+
+        def examples(pairs):
+            return [Example(self.view(i), self.view(o)) for i, o in pairs]
+
+        self.tasks = {name: Task(name, entry['subset'],
+                                 examples(entry['train']),
+                                 examples(entry['test']))
+                      for name, entry in index['tasks'].items()}
+
+    def view(self, entry):
+        """the grid at [offset, height, width] in the buffer"""
+        if entry is None:
+            return None
+        offset, height, width = entry
+        grid = self.buffer[offset:offset + height * width].reshape(height, width)
+        return grid.view(np.ndarray)
+
+
+# the store shared by everything in the process. It's created the first time
+# it's needed, so importing this module doesn't touch the filesystem. If a
+# packed corpus exists and is up to date, that is used instead of the json files
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        if os.path.exists(PACKED_PATH + '.bin') and is_current(PACKED_PATH):
+            _store = PackedTaskStore()
+        else:
+            if os.path.exists(PACKED_PATH + '.bin'):
+                print(f"Warning. {PACKED_PATH}.bin doesn't match the json files, "
+                      f"so they are loaded instead. Run python task_store.py to repack.")
+            _store = TaskStore()
+    return _store
+
+def get_task(task_name):
+    """get a task (by id, with or without .json) from the shared store"""
+    return get_store()[task_name]
+
+
+if __name__ == '__main__':
+    store = TaskStore()
+    pack(store)
+    print(f'Packed {len(store)} tasks into {PACKED_PATH}.bin and {PACKED_PATH}.json')
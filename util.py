@@ -2,10 +2,13 @@
 
 Izzy Brand, 2020
 """
-import json
+import hashlib
 from matplotlib import pyplot as plt
 from matplotlib.colors import ListedColormap
 import numpy as np
+import weakref
+
+from task_store import get_task
 
 color_names = [
     "black",
@@ -57,8 +60,169 @@ def str_type(my_type, input_only=False):
     else:
         return my_type
 
+# NOTE(izzy): comparing two grids cell by cell allocates a whole array of
+# bools, and we compare every candidate's output to the target of every
+# example. grid_hash is a digest of a grid's shape and values, which is
+# remembered for grids that can't change (read-only arrays, all the way down
+# to the memory they are views of), like the grids in the task store and the
+# values in an ExprCache. match compares the remembered hashes first (if it
+# has them), and TargetIndex finds every target a grid is equal to with a
+# single dict lookup. Equal hashes are always confirmed cell by cell, so a
+# collision can't cause a false match.
+#
+# Grids which are equal (pred == target everywhere) get the same hash
+# whatever their dtype, as long as their values are integers (or floats with
+# integer values) smaller than 2**53.
+
+# the hash of each read-only grid, by id (with a weakref to the grid, so the
+# entry is dropped when the grid is)
+grid_hashes = {}
+
+def is_frozen(g):
+    """whether the contents of g can't change"""
+    while isinstance(g, np.ndarray):
+        if g.flags.writeable:
+            return False
+        g = g.base
+    return True
+
+def canonical(g):
+    """the values of g as a contiguous array of a dtype that only depends on
+    the values (or None if it isn't a grid of numbers)"""
+    if g.dtype == np.uint8 or g.dtype == bool:
+        return np.ascontiguousarray(g).view(np.uint8)
+    elif g.dtype.kind == 'f':
+        if g.size and not (np.isfinite(g).all() and (np.abs(g) < 2**53).all()
+                           and (g == np.round(g)).all()):
+            return np.ascontiguousarray(g, dtype=np.float64)
+    elif g.dtype.kind not in 'biu':
+        return None
+    if g.size == 0 or (g.min() >= 0 and g.max() <= 255):
+        return np.ascontiguousarray(g, dtype=np.uint8)
+    return np.ascontiguousarray(g, dtype=np.int64)
+
+def grid_hash(g):
+    """a digest of the shape and values of the grid g (None if g isn't an
+    array of numbers)"""
+    if not isinstance(g, np.ndarray):
+        return None
+    entry = grid_hashes.get(id(g))
+    if entry is not None and entry[0]() is g:
+        return entry[1]
+
+    values = canonical(g)
+    if values is None:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{g.shape}{values.dtype.str}'.encode())
+    h.update(values.tobytes())
+    digest = h.digest()
+
+    if is_frozen(g):
+        key = id(g)
+        def forget(ref):
+            if grid_hashes.get(key, (None,))[0] is ref:
+                del grid_hashes[key]
+        grid_hashes[key] = (weakref.ref(g, forget), digest)
+    return digest
+
+def cached_grid_hash(g):
+    """the hash of g if it has already been found, otherwise None"""
+    entry = grid_hashes.get(id(g))
+    if entry is not None and entry[0]() is g:
+        return entry[1]
+    return None
+
 def match(pred, target):
-    return pred.shape == target.shape and (pred == target).all()
+    if pred.shape != target.shape:
+        return False
+    pred_hash, target_hash = cached_grid_hash(pred), cached_grid_hash(target)
+    if pred_hash is not None and target_hash is not None and pred_hash != target_hash:
+        return False
+    return (pred == target).all()
+
+
+class TargetIndex(object):
+    """Finds which of a list of target grids a grid is equal to
+
+    Args:
+        targets: The grids
+    """
+
+    def __init__(self, targets):
+        self.targets = list(targets)
+        self.index = {}
+        for i, t in enumerate(self.targets):
+            self.index.setdefault(grid_hash(t), []).append(i)
+
+    def equal_to(self, pred, pred_hash=None):
+        """the indices of the targets which pred is equal to. pred_hash is
+        grid_hash(pred), if it's already known"""
+        if pred_hash is None:
+            pred_hash = grid_hash(pred)
+            if pred_hash is None:
+                return []
+        return [i for i in self.index.get(pred_hash, ())
+                if match(pred, self.targets[i])]
+
+
+# NOTE(izzy): most candidate programs are wrong on every example, so when
+# all we want to know is whether a program gets every example exactly right,
+# there's no point running it on the rest of the examples once it gets one
+# wrong. The ExactMatcher also keeps track of how often each example is the
+# one that rejects a candidate, and tries the examples that reject the most
+# candidates (for the fewest cells of output) first.
+
+class ExactMatcher(object):
+    """Checks whether a program gets every example of a task exactly right
+
+    Args:
+        examples: The (input, output) pairs (for instance task.train).
+            Examples without an output (like the test pairs of a task that
+            doesn't include the test outputs) can't be checked, so they're
+            skipped
+    """
+
+    def __init__(self, examples):
+        self.examples = list(examples)
+        # how many times each example has been checked, and has rejected a
+        # candidate
+        self.checks = [0] * len(self.examples)
+        self.rejections = [0] * len(self.examples)
+        self.order = [i for i, (_, output) in enumerate(self.examples)
+                      if output is not None]
+        self.reorder()
+        # so that match can reject a wrong output by its hash (if it has one)
+        for i in self.order:
+            grid_hash(self.examples[i][1])
+
+    def reorder(self):
+        def priority(i):
+            # the (smoothed) rate at which example i rejects candidates, per
+            # cell of its output
+            rate = (self.rejections[i] + 1) / (self.checks[i] + 2)
+            return -rate / max(self.examples[i][1].size, 1)
+        self.order.sort(key=priority)
+
+    def check(self, predict):
+        """whether predict(i) matches the output of example i for every i,
+        stopping at the first example it gets wrong. predict raising an
+        exception counts as getting the example wrong"""
+        for i in self.order:
+            self.checks[i] += 1
+            try:
+                correct = match(predict(i), self.examples[i][1])
+            except Exception:
+                correct = False
+            if not correct:
+                self.rejections[i] += 1
+                self.reorder()
+                return False
+        return True
+
+    def __str__(self):
+        return 'ExactMatcher(' + ', '.join(
+            f'{i}: {self.rejections[i]}/{self.checks[i]} rejected' for i in self.order) + ')'
 
 def vis(grid, block=True):
     plt.imshow(grid, **imshow_kwargs)
@@ -75,18 +239,16 @@ def eval_primitive_or_program(p, x):
     else: return p(x)
 
 def run_program_on_task_train(program, task_name, vis=True):
-    with open(f'ARC/data/training/{task_name}') as f:
-        j = json.load(f)
+    task = get_task(task_name)
 
     score = 0
     if vis:
-        n = len(j['train'])
+        n = len(task.train)
         fig, axarr = plt.subplots(n,3)
 
-    for i, t in enumerate(j['train']):
-        input_grid = np.array(t['input'])
+    for i, t in enumerate(task.train):
+        input_grid, target = t
         pred = program.eval(input_grid)
-        target = np.array(t['output'])
         score += match(pred, target)
         if vis:
             axarr[i,0].imshow(input_grid, **imshow_kwargs)
@@ -95,4 +257,4 @@ def run_program_on_task_train(program, task_name, vis=True):
 
     if vis: plt.show()
 
-    return float(score)/len(j['train'])
+    return float(score)/len(task.train)